@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from backend import DB_ENGINE
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY", "unsafe-dev-secret-key-change-me")
@@ -49,7 +51,6 @@ TEMPLATES = [
 WSGI_APPLICATION = "backend.wsgi.application"
 ASGI_APPLICATION = "backend.asgi.application"
 
-DB_ENGINE = os.getenv("DJANGO_DB_ENGINE", "sqlite").strip().lower()
 if DB_ENGINE == "mysql":
     DATABASES = {
         "default": {
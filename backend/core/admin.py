@@ -24,7 +24,7 @@ class UserActionAdmin(admin.ModelAdmin):
     list_display = ("telegram_id", "action", "created_at")
     list_filter = ("action", "created_at")
     search_fields = ("telegram_id", "username", "first_name", "last_name", "details")
-    readonly_fields = ("created_at",)
+    readonly_fields = ("created_at", "raw_payload")
 
 
 @admin.register(AdItem)
@@ -32,4 +32,4 @@ class AdItemAdmin(admin.ModelAdmin):
     list_display = ("ad_id", "title", "source_type", "category", "price", "status", "updated_at")
     list_filter = ("source_type", "status", "category")
     search_fields = ("ad_id", "external_id", "title", "location", "author_username")
-    readonly_fields = ("created_at", "updated_at")
+    readonly_fields = ("created_at", "updated_at", "raw_payload", "last_update")
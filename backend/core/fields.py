@@ -0,0 +1,58 @@
+import zlib
+
+from django.db import models
+
+from . import jsonlib
+
+
+class EncodedJSON(bytes):
+    """Уже сериализованный JSON (например, тело запроса): поле сожмёт его без повторного dumps."""
+
+
+class CompressedJSONField(models.BinaryField):
+    """JSON-значение, которое хранится в БД как zlib-сжатый BLOB.
+
+    Для кода моделей поле ведёт себя как JSONField: на входе и выходе — dict/list.
+    """
+
+    def __init__(self, *args, compress_level: int = 3, **kwargs):
+        self.compress_level = compress_level
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.compress_level != 3:
+            kwargs["compress_level"] = self.compress_level
+        return name, path, args, kwargs
+
+    def compress(self, value) -> bytes:
+        return zlib.compress(jsonlib.dumps(value), self.compress_level)
+
+    @staticmethod
+    def decompress(value):
+        return jsonlib.loads(zlib.decompress(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        if isinstance(value, EncodedJSON):
+            value = zlib.compress(value, self.compress_level)
+        elif not isinstance(value, (bytes, bytearray, memoryview)):
+            value = self.compress(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return self.decompress(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return self.decompress(value)
+        # JSON-текст из value_to_string (dumpdata/loaddata), как у JSONField
+        if isinstance(value, str):
+            return jsonlib.loads(value)
+        return value
+
+    def value_to_string(self, obj):
+        return jsonlib.dumps(self.value_from_object(obj)).decode("utf-8")
@@ -0,0 +1,23 @@
+"""JSON-сериализация через orjson с откатом на стандартный json."""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson не установлен
+    orjson = None
+
+
+def dumps(value) -> bytes:
+    """Компактный JSON в UTF-8 (без экранирования не-ASCII символов)."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes | bytearray | memoryview | str):
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
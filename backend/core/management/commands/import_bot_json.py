@@ -1,35 +1,221 @@
-import json
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 
+import ijson
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
 from core.models import AdItem, TelegramUser, UserAction
 
+BULK_BATCH_SIZE = 5000
+
+_CURRENT_TZ = timezone.get_current_timezone()
+
+USER_UPDATE_FIELDS = [
+    "username",
+    "first_name",
+    "last_name",
+    "language_code",
+    "phone_number",
+    "avatar_file_id",
+    "role",
+    "is_authenticated",
+    "authenticated_at",
+    "updated_at",
+]
+
+AD_UPDATE_FIELDS = [
+    "source_type",
+    "external_id",
+    "title",
+    "category",
+    "price",
+    "year",
+    "details",
+    "location",
+    "image",
+    "status",
+    "author_telegram_id",
+    "author_username",
+    "author_first_name",
+    "author_last_name",
+    "created_at_remote",
+    "raw_payload",
+    "updated_at",
+]
+
+
+def _s(value) -> str:
+    """Строковое поле: как `str(value or "")`, но без лишних преобразований для str."""
+    if type(value) is str:
+        return value
+    return str(value) if value else ""
+
+
+def _i(value) -> int | None:
+    """Целое или None для пустых и некорректных значений."""
+    if type(value) is int:
+        return value
+    if value is None:
+        return None
+    try:
+        return int(value) if str(value).strip() else None
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=1 << 16)
+def _parse_dt_cached(value: str):
+    # В логах метки времени часто повторяются, поэтому разбор кэшируется по исходной строке.
+    parsed = parse_datetime(value)
+    if parsed and timezone.is_naive(parsed):
+        return timezone.make_aware(parsed, _CURRENT_TZ)
+    return parsed
+
 
 def _parse_dt(value):
     if not value:
         return None
-    parsed = parse_datetime(str(value))
-    if not parsed:
-        return None
-    if timezone.is_naive(parsed):
-        return timezone.make_aware(parsed, timezone.get_current_timezone())
-    return parsed
+    return _parse_dt_cached(_s(value))
+
+
+_ROLE_MAP = {
+    **dict.fromkeys(
+        ("leasing", "leasing_company", "лизинговая", "лизинговая компания", "лизинговая_компания"),
+        TelegramUser.ROLE_LEASING_COMPANY,
+    ),
+    **dict.fromkeys(("admin", "админ", "администратор"), TelegramUser.ROLE_ADMIN),
+}
 
 
 def _normalize_role(role: str | None) -> str:
-    normalized = str(role or TelegramUser.ROLE_USER).strip().lower()
-    if normalized in {"leasing", "leasing_company", "лизинговая", "лизинговая компания", "лизинговая_компания"}:
-        return TelegramUser.ROLE_LEASING_COMPANY
-    if normalized in {"admin", "админ", "администратор"}:
-        return TelegramUser.ROLE_ADMIN
-    return TelegramUser.ROLE_USER
+    return _ROLE_MAP.get(_s(role).strip().lower(), TelegramUser.ROLE_USER)
+
+
+def _chunks(iterable, size: int = BULK_BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def _bulk_load_session():
+    """Ослабляет проверки MySQL на время массовой загрузки внутри одной транзакции.
+
+    unique_checks не отключается: upsert через bulk_create опирается на уникальные индексы.
+    """
+    if connection.vendor != "mysql":
+        yield
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SET foreign_key_checks = 0")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SET foreign_key_checks = 1")
+
+
+def _conflict_target(*fields: str) -> list[str] | None:
+    """unique_fields для upsert; MySQL цель конфликта не принимает и берёт уникальный индекс сам."""
+    if connection.features.supports_update_conflicts_with_target:
+        return list(fields)
+    return None
+
+
+def _json_root_event(path: Path) -> str | None:
+    """Возвращает первое событие парсера (start_map / start_array) без чтения всего файла."""
+    with path.open("rb") as f:
+        for _, event, _ in ijson.parse(f):
+            return event
+    return None
+
+
+def _build_user(raw_user) -> TelegramUser | None:
+    if not isinstance(raw_user, dict):
+        return None
+    telegram_id = _i(raw_user.get("telegram_id"))
+    if not telegram_id:
+        return None
+
+    return TelegramUser(
+        telegram_id=telegram_id,
+        username=_s(raw_user.get("username")),
+        first_name=_s(raw_user.get("first_name")),
+        last_name=_s(raw_user.get("last_name")),
+        language_code=_s(raw_user.get("language_code")),
+        phone_number=_s(raw_user.get("phone_number")),
+        avatar_file_id=_s(raw_user.get("avatar_file_id")),
+        role=_normalize_role(raw_user.get("role")),
+        is_authenticated=bool(raw_user.get("is_authenticated", False)),
+        authenticated_at=_parse_dt(raw_user.get("authenticated_at")),
+    )
+
+
+def _build_action(event) -> UserAction | None:
+    if not isinstance(event, dict):
+        return None
+    telegram_id = _i(event.get("user_id"))
+    action = _s(event.get("action")).strip()
+    if not telegram_id or not action:
+        return None
+
+    return UserAction(
+        telegram_id=telegram_id,
+        username=_s(event.get("username")),
+        first_name=_s(event.get("first_name")),
+        last_name=_s(event.get("last_name")),
+        action=action,
+        details=_s(event.get("details")),
+        raw_payload=event,
+    )
+
+
+def _build_ad(item) -> AdItem | None:
+    if not isinstance(item, dict):
+        return None
+    ad_id = _s(item.get("id")).strip()
+    title = _s(item.get("title")).strip()
+    if not ad_id or not title:
+        return None
+
+    author = item.get("author") if isinstance(item.get("author"), dict) else {}
+    source_type = _s(item.get("source_type")).strip().lower()
+    if source_type not in {AdItem.SOURCE_EXCEL, AdItem.SOURCE_MANUAL}:
+        source_type = AdItem.SOURCE_MANUAL
+
+    status = _s(item.get("status")).strip().lower()
+    if status not in {AdItem.STATUS_ACTIVE, AdItem.STATUS_INACTIVE, AdItem.STATUS_ARCHIVED}:
+        status = AdItem.STATUS_ACTIVE
+
+    return AdItem(
+        ad_id=ad_id,
+        source_type=source_type,
+        external_id=_s(item.get("external_id")),
+        title=title,
+        category=_s(item.get("category")),
+        price=_i(item.get("price")) or 0,
+        year=_i(item.get("year")),
+        details=_s(item.get("details")),
+        location=_s(item.get("location")),
+        image=_s(item.get("image")),
+        status=status,
+        author_telegram_id=_i(author.get("id")),
+        author_username=_s(author.get("username")),
+        author_first_name=_s(author.get("first_name")),
+        author_last_name=_s(author.get("last_name")),
+        created_at_remote=_parse_dt(item.get("createdAt")),
+        raw_payload=item,
+    )
 
 
 class Command(BaseCommand):
-    help = "Импортирует auth_users.json, users_log.json и ads_feed.json в Django БД"
+    help = "Импортирует auth_users.json, users_log.jsonl (или users_log.json) и ads_feed.json в Django БД"
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -42,14 +228,18 @@ class Command(BaseCommand):
         project_root = Path(options["project_root"]).resolve()
 
         auth_file = project_root / "auth_users.json"
-        logs_file = project_root / "users_log.json"
+        logs_file = project_root / "users_log.jsonl"
+        if not logs_file.exists():
+            # Старый формат лога — JSON-массив.
+            logs_file = project_root / "users_log.json"
         ads_file = project_root / "ads_feed.json"
 
         self.stdout.write(f"Project root: {project_root}")
 
-        users_count = self._import_users(auth_file)
-        actions_count = self._import_actions(logs_file)
-        ads_count = self._import_ads(ads_file)
+        with transaction.atomic(), _bulk_load_session():
+            users_count = self._import_users(auth_file)
+            actions_count = self._import_actions(logs_file)
+            ads_count = self._import_ads(ads_file)
 
         self.stdout.write(self.style.SUCCESS(f"Импорт завершен: users={users_count}, actions={actions_count}, ads={ads_count}"))
 
@@ -58,38 +248,25 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING(f"Пропущено: {path.name} не найден"))
             return 0
 
-        data = json.loads(path.read_text(encoding="utf-8"))
-        if not isinstance(data, dict):
+        if _json_root_event(path) != "start_map":
             self.stdout.write(self.style.WARNING(f"Пропущено: {path.name} имеет неверный формат"))
             return 0
 
         count = 0
-        for raw_user in data.values():
-            if not isinstance(raw_user, dict):
-                continue
-            telegram_id = raw_user.get("telegram_id")
-            if not telegram_id:
-                continue
-            try:
-                telegram_id = int(telegram_id)
-            except Exception:
-                continue
-
-            TelegramUser.objects.update_or_create(
-                telegram_id=telegram_id,
-                defaults={
-                    "username": str(raw_user.get("username") or ""),
-                    "first_name": str(raw_user.get("first_name") or ""),
-                    "last_name": str(raw_user.get("last_name") or ""),
-                    "language_code": str(raw_user.get("language_code") or ""),
-                    "phone_number": str(raw_user.get("phone_number") or ""),
-                    "avatar_file_id": str(raw_user.get("avatar_file_id") or ""),
-                    "role": _normalize_role(raw_user.get("role")),
-                    "is_authenticated": bool(raw_user.get("is_authenticated", False)),
-                    "authenticated_at": _parse_dt(raw_user.get("authenticated_at")),
-                },
-            )
-            count += 1
+        with path.open("rb") as f:
+            raw_users = (raw_user for _, raw_user in ijson.kvitems(f, "", use_float=True))
+            built = filter(None, map(_build_user, raw_users))
+            for batch in _chunks(built):
+                # Ключ по telegram_id: при дублях побеждает последняя запись, как и при update_or_create.
+                users = {user.telegram_id: user for user in batch}
+                TelegramUser.objects.bulk_create(
+                    users.values(),
+                    batch_size=BULK_BATCH_SIZE,
+                    update_conflicts=True,
+                    unique_fields=_conflict_target("telegram_id"),
+                    update_fields=USER_UPDATE_FIELDS,
+                )
+                count += len(users)
 
         self.stdout.write(self.style.SUCCESS(f"Импортировано пользователей: {count}"))
         return count
@@ -99,37 +276,31 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING(f"Пропущено: {path.name} не найден"))
             return 0
 
-        data = json.loads(path.read_text(encoding="utf-8"))
-        if not isinstance(data, list):
+        # JSON Lines — поток значений верхнего уровня, старый формат — элементы массива.
+        is_jsonl = path.suffix == ".jsonl"
+        if not is_jsonl and _json_root_event(path) != "start_array":
             self.stdout.write(self.style.WARNING(f"Пропущено: {path.name} имеет неверный формат"))
             return 0
 
         count = 0
-        for event in data:
-            if not isinstance(event, dict):
-                continue
-            telegram_id = event.get("user_id")
-            action = str(event.get("action") or "").strip()
-            if not telegram_id or not action:
-                continue
-
-            try:
-                telegram_id = int(telegram_id)
-            except Exception:
-                continue
-
-            user = TelegramUser.objects.filter(telegram_id=telegram_id).first()
-            UserAction.objects.create(
-                user=user,
-                telegram_id=telegram_id,
-                username=str(event.get("username") or ""),
-                first_name=str(event.get("first_name") or ""),
-                last_name=str(event.get("last_name") or ""),
-                action=action,
-                details=str(event.get("details") or ""),
-                raw_payload=event,
-            )
-            count += 1
+        with path.open("rb") as f:
+            if is_jsonl:
+                events = ijson.items(f, "", multiple_values=True, use_float=True)
+            else:
+                events = ijson.items(f, "item", use_float=True)
+            built = filter(None, map(_build_action, events))
+            for actions in _chunks(built):
+                # Один запрос на всех авторов пачки вместо SELECT на каждое событие.
+                user_pk_map = dict(
+                    TelegramUser.objects.filter(
+                        telegram_id__in={action.telegram_id for action in actions}
+                    ).values_list("telegram_id", "id")
+                )
+                for action in actions:
+                    action.user_id = user_pk_map.get(action.telegram_id)
+
+                UserAction.objects.bulk_create(actions, batch_size=BULK_BATCH_SIZE)
+                count += len(actions)
 
         self.stdout.write(self.style.SUCCESS(f"Импортировано действий: {count}"))
         return count
@@ -139,69 +310,28 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING(f"Пропущено: {path.name} не найден"))
             return 0
 
-        root = json.loads(path.read_text(encoding="utf-8"))
-        items = root.get("items") if isinstance(root, dict) else root
-        if not isinstance(items, list):
+        root_event = _json_root_event(path)
+        if root_event == "start_map":
+            prefix = "items.item"
+        elif root_event == "start_array":
+            prefix = "item"
+        else:
             self.stdout.write(self.style.WARNING(f"Пропущено: {path.name} имеет неверный формат"))
             return 0
 
         count = 0
-        for item in items:
-            if not isinstance(item, dict):
-                continue
-            ad_id = str(item.get("id") or "").strip()
-            title = str(item.get("title") or "").strip()
-            if not ad_id or not title:
-                continue
-
-            author = item.get("author") if isinstance(item.get("author"), dict) else {}
-            source_type = str(item.get("source_type") or "manual").strip().lower()
-            if source_type not in {AdItem.SOURCE_EXCEL, AdItem.SOURCE_MANUAL}:
-                source_type = AdItem.SOURCE_MANUAL
-
-            status = str(item.get("status") or AdItem.STATUS_ACTIVE).strip().lower()
-            if status not in {AdItem.STATUS_ACTIVE, AdItem.STATUS_INACTIVE, AdItem.STATUS_ARCHIVED}:
-                status = AdItem.STATUS_ACTIVE
-
-            try:
-                price = int(item.get("price") or 0)
-            except Exception:
-                price = 0
-
-            year = item.get("year")
-            try:
-                year = int(year) if year is not None and str(year).strip() else None
-            except Exception:
-                year = None
-
-            author_id = author.get("id")
-            try:
-                author_id = int(author_id) if author_id is not None and str(author_id).strip() else None
-            except Exception:
-                author_id = None
-
-            AdItem.objects.update_or_create(
-                ad_id=ad_id,
-                defaults={
-                    "source_type": source_type,
-                    "external_id": str(item.get("external_id") or ""),
-                    "title": title,
-                    "category": str(item.get("category") or ""),
-                    "price": price,
-                    "year": year,
-                    "details": str(item.get("details") or ""),
-                    "location": str(item.get("location") or ""),
-                    "image": str(item.get("image") or ""),
-                    "status": status,
-                    "author_telegram_id": author_id,
-                    "author_username": str(author.get("username") or ""),
-                    "author_first_name": str(author.get("first_name") or ""),
-                    "author_last_name": str(author.get("last_name") or ""),
-                    "created_at_remote": _parse_dt(item.get("createdAt")),
-                    "raw_payload": item,
-                },
-            )
-            count += 1
+        with path.open("rb") as f:
+            built = filter(None, map(_build_ad, ijson.items(f, prefix, use_float=True)))
+            for batch in _chunks(built):
+                ads = {ad.ad_id: ad for ad in batch}
+                AdItem.objects.bulk_create(
+                    ads.values(),
+                    batch_size=BULK_BATCH_SIZE,
+                    update_conflicts=True,
+                    unique_fields=_conflict_target("ad_id"),
+                    update_fields=AD_UPDATE_FIELDS,
+                )
+                count += len(ads)
 
         self.stdout.write(self.style.SUCCESS(f"Импортировано объявлений: {count}"))
         return count
@@ -0,0 +1,58 @@
+# Generated manually: raw_payload is stored as zlib-compressed JSON.
+from django.db import migrations
+
+import core.fields
+
+BATCH_SIZE = 1000
+
+
+def copy_raw_payload(apps, schema_editor):
+    for model_name in ("AdItem", "UserAction"):
+        model = apps.get_model("core", model_name)
+        batch = []
+        for obj in model.objects.only("id", "raw_payload").iterator(chunk_size=BATCH_SIZE):
+            obj.raw_payload_compressed = obj.raw_payload if obj.raw_payload is not None else {}
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, ["raw_payload_compressed"])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ["raw_payload_compressed"])
+
+
+def copy_raw_payload_back(apps, schema_editor):
+    for model_name in ("AdItem", "UserAction"):
+        model = apps.get_model("core", model_name)
+        batch = []
+        for obj in model.objects.only("id", "raw_payload_compressed").iterator(chunk_size=BATCH_SIZE):
+            obj.raw_payload = obj.raw_payload_compressed if obj.raw_payload_compressed is not None else {}
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, ["raw_payload"])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ["raw_payload"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="aditem",
+            name="raw_payload_compressed",
+            field=core.fields.CompressedJSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="useraction",
+            name="raw_payload_compressed",
+            field=core.fields.CompressedJSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(copy_raw_payload, copy_raw_payload_back),
+        migrations.RemoveField(model_name="aditem", name="raw_payload"),
+        migrations.RemoveField(model_name="useraction", name="raw_payload"),
+        migrations.RenameField(model_name="aditem", old_name="raw_payload_compressed", new_name="raw_payload"),
+        migrations.RenameField(model_name="useraction", old_name="raw_payload_compressed", new_name="raw_payload"),
+    ]
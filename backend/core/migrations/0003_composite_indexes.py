@@ -0,0 +1,31 @@
+# Generated manually: composite indexes for admin filters and default orderings.
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0002_compress_raw_payload"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="telegramuser",
+            index=models.Index(fields=["role", "is_authenticated", "-updated_at"], name="core_tguser_role_auth_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="useraction",
+            index=models.Index(fields=["action", "-created_at"], name="core_action_action_ts_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="useraction",
+            index=models.Index(fields=["telegram_id", "-created_at"], name="core_action_tg_ts_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="aditem",
+            index=models.Index(fields=["status", "source_type", "category"], name="core_aditem_filters_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="aditem",
+            index=models.Index(fields=["status", "-updated_at"], name="core_aditem_status_upd_idx"),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated manually: raw_payload defaults to NULL instead of an empty dict.
+from django.db import migrations
+
+import core.fields
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0003_composite_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="aditem",
+            name="raw_payload",
+            field=core.fields.CompressedJSONField(blank=True, default=None, null=True),
+        ),
+        migrations.AlterField(
+            model_name="useraction",
+            name="raw_payload",
+            field=core.fields.CompressedJSONField(blank=True, default=None, null=True),
+        ),
+    ]
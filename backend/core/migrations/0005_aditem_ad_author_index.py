@@ -0,0 +1,15 @@
+# Generated manually: composite index for permission-checked ad lookups.
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0004_raw_payload_nullable"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="aditem",
+            index=models.Index(fields=["ad_id", "author_telegram_id"], name="core_aditem_ad_author_idx"),
+        ),
+    ]
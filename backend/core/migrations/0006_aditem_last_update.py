@@ -0,0 +1,51 @@
+# Generated manually: last_update moves out of raw_payload into its own column.
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def move_last_update(apps, schema_editor):
+    AdItem = apps.get_model("core", "AdItem")
+    batch = []
+    for obj in AdItem.objects.only("id", "raw_payload").iterator(chunk_size=BATCH_SIZE):
+        if not isinstance(obj.raw_payload, dict) or "last_update" not in obj.raw_payload:
+            continue
+        obj.last_update = obj.raw_payload.pop("last_update")
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            AdItem.objects.bulk_update(batch, ["raw_payload", "last_update"])
+            batch = []
+    if batch:
+        AdItem.objects.bulk_update(batch, ["raw_payload", "last_update"])
+
+
+def move_last_update_back(apps, schema_editor):
+    AdItem = apps.get_model("core", "AdItem")
+    batch = []
+    for obj in AdItem.objects.filter(last_update__isnull=False).only("id", "raw_payload", "last_update").iterator(
+        chunk_size=BATCH_SIZE
+    ):
+        payload = obj.raw_payload if isinstance(obj.raw_payload, dict) else {}
+        payload["last_update"] = obj.last_update
+        obj.raw_payload = payload
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            AdItem.objects.bulk_update(batch, ["raw_payload"])
+            batch = []
+    if batch:
+        AdItem.objects.bulk_update(batch, ["raw_payload"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0005_aditem_ad_author_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="aditem",
+            name="last_update",
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+        migrations.RunPython(move_last_update, move_last_update_back),
+    ]
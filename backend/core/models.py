@@ -1,6 +1,8 @@
 from django.db import models
 from django.utils import timezone
 
+from .fields import CompressedJSONField
+
 
 class TelegramUser(models.Model):
     ROLE_USER = "user"
@@ -30,6 +32,9 @@ class TelegramUser(models.Model):
         ordering = ["-updated_at"]
         verbose_name = "Пользователь Telegram"
         verbose_name_plural = "Пользователи Telegram"
+        indexes = [
+            models.Index(fields=["role", "is_authenticated", "-updated_at"], name="core_tguser_role_auth_idx"),
+        ]
 
     def __str__(self) -> str:
         username = f"@{self.username}" if self.username else "без username"
@@ -51,12 +56,16 @@ class UserAction(models.Model):
     action = models.CharField(max_length=128, db_index=True)
     details = models.TextField(blank=True)
     created_at = models.DateTimeField(default=timezone.now, db_index=True)
-    raw_payload = models.JSONField(default=dict, blank=True)
+    raw_payload = CompressedJSONField(null=True, blank=True, default=None)
 
     class Meta:
         ordering = ["-created_at"]
         verbose_name = "Действие пользователя"
         verbose_name_plural = "Действия пользователей"
+        indexes = [
+            models.Index(fields=["action", "-created_at"], name="core_action_action_ts_idx"),
+            models.Index(fields=["telegram_id", "-created_at"], name="core_action_tg_ts_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.telegram_id}: {self.action}"
@@ -99,7 +108,9 @@ class AdItem(models.Model):
     author_last_name = models.CharField(max_length=255, blank=True)
 
     created_at_remote = models.DateTimeField(null=True, blank=True)
-    raw_payload = models.JSONField(default=dict, blank=True)
+    raw_payload = CompressedJSONField(null=True, blank=True, default=None)
+    # Последние изменения через API хранятся отдельно, чтобы не переписывать raw_payload целиком.
+    last_update = models.JSONField(null=True, blank=True, default=None)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -108,6 +119,12 @@ class AdItem(models.Model):
         ordering = ["-updated_at"]
         verbose_name = "Объявление"
         verbose_name_plural = "Объявления"
+        indexes = [
+            models.Index(fields=["status", "source_type", "category"], name="core_aditem_filters_idx"),
+            models.Index(fields=["status", "-updated_at"], name="core_aditem_status_upd_idx"),
+            # Проверка прав в WHERE: ad_id = ... AND author_telegram_id = ... покрывается индексом целиком.
+            models.Index(fields=["ad_id", "author_telegram_id"], name="core_aditem_ad_author_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.ad_id}: {self.title[:60]}"
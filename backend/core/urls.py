@@ -7,6 +7,7 @@ urlpatterns = [
     path("users/upsert/", views.upsert_user, name="upsert_user"),
     path("users/<int:telegram_id>/role/", views.user_role, name="user_role"),
     path("actions/", views.create_action, name="create_action"),
+    path("actions/bulk/", views.bulk_create_actions, name="bulk_create_actions"),
     path("ads/upsert/", views.upsert_ad, name="upsert_ad"),
     path("ads/bulk-upsert/", views.bulk_upsert_ads, name="bulk_upsert_ads"),
     path("ads/update/", views.update_ad_with_permissions, name="update_ad_with_permissions"),
@@ -1,204 +1,359 @@
-import json
-from functools import wraps
+import hmac
+import math
+from functools import lru_cache, wraps
 
 from django.conf import settings
-from django.db import transaction
-from django.http import HttpRequest, JsonResponse
+from django.db import connection, transaction
+from django.db.models import Subquery
+from django.http import HttpRequest, HttpResponse
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 
+from . import jsonlib
+from .fields import EncodedJSON
 from .models import AdItem, TelegramUser, UserAction
 
+# Бэкенд не активирует часовые пояса per-request, поэтому зона по умолчанию фиксируется один раз.
+_CURRENT_TZ = timezone.get_current_timezone()
 
-def normalize_role(role: str | None) -> str:
-    normalized = str(role or TelegramUser.ROLE_USER).strip().lower()
-    if normalized in {
+_ROLE_LEASING_ALIASES = frozenset(
+    {
         "leasing",
         "leasing_company",
         "лизинговая",
         "лизинговая компания",
         "лизинговая_компания",
-    }:
+    }
+)
+_ROLE_ADMIN_ALIASES = frozenset({"admin", "админ", "администратор"})
+_AD_STATUSES = frozenset({AdItem.STATUS_ACTIVE, AdItem.STATUS_INACTIVE, AdItem.STATUS_ARCHIVED})
+_AD_SOURCES = frozenset({AdItem.SOURCE_EXCEL, AdItem.SOURCE_MANUAL})
+_DEFAULT_AD_STATUS = AdItem.STATUS_ACTIVE
+_DEFAULT_AD_SOURCE = AdItem.SOURCE_MANUAL
+_MISSING = object()
+BULK_BATCH_SIZE = 1000
+# Ключ читается из настроек один раз при импорте; None — ключ не задан.
+_EXPECTED_API_KEY = (settings.BOT_API_KEY or "").encode() or None
+
+
+def _conflict_target(*fields: str) -> list[str] | None:
+    """unique_fields для bulk_create(update_conflicts=True).
+
+    MySQL не принимает цель конфликта: ON DUPLICATE KEY UPDATE сам срабатывает
+    по уникальному индексу, а Django на явные unique_fields бросает NotSupportedError.
+    """
+    if connection.features.supports_update_conflicts_with_target:
+        return list(fields)
+    return None
+
+
+def _s(value) -> str:
+    """Как `str(value or "")`, но без лишнего преобразования, если значение уже str."""
+    if type(value) is str:
+        return value
+    return str(value) if value else ""
+
+
+def _sl(value) -> str:
+    return _s(value).strip().lower()
+
+
+def _to_int(value, default=None):
+    """Приведение к int через явные проверки типа, без try/except на каждом элементе."""
+    if value is None:
+        return default
+    value_type = type(value)
+    if value_type is int:
+        return value
+    if value_type is bool:
+        return int(value)
+    if value_type is float:
+        return int(value) if math.isfinite(value) else default
+    text = _s(value).strip()
+    digits = text[1:] if text[:1] in ("-", "+") else text
+    # isdecimal() совпадает с набором цифр, которые принимает int(); isdigit() пропустил бы "²".
+    return int(text) if digits.isdecimal() else default
+
+
+@lru_cache(maxsize=64)
+def _normalize_role_key(normalized: str) -> str:
+    if normalized in _ROLE_LEASING_ALIASES:
         return TelegramUser.ROLE_LEASING_COMPANY
-    if normalized in {"admin", "админ", "администратор"}:
+    if normalized in _ROLE_ADMIN_ALIASES:
         return TelegramUser.ROLE_ADMIN
     return TelegramUser.ROLE_USER
 
 
+def normalize_role(role: str | None) -> str:
+    return _normalize_role_key(_sl(role))
+
+
+@lru_cache(maxsize=1024)
+def _parse_iso_datetime_cached(value: str):
+    parsed = parse_datetime(value)
+    if parsed and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, _CURRENT_TZ)
+    return parsed
+
+
 def parse_iso_datetime(value):
     if not value:
         return None
-    parsed = parse_datetime(str(value))
-    if not parsed:
-        return None
-    if timezone.is_naive(parsed):
-        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
-    return parsed
+    return _parse_iso_datetime_cached(_s(value))
 
 
 def parse_json_request(request: HttpRequest) -> dict:
+    # request.body уже ограничен DATA_UPLOAD_MAX_MEMORY_SIZE; байты разбираются без .decode().
+    body = request.body
+    if not body:
+        return {}
     try:
-        return json.loads(request.body.decode("utf-8") or "{}")
-    except Exception:
+        data = jsonlib.loads(body)
+    except ValueError:
         return {}
+    return data if isinstance(data, dict) else {}
+
+
+def json_response(payload: dict, status: int = 200) -> HttpResponse:
+    return HttpResponse(jsonlib.dumps(payload), status=status, content_type="application/json")
+
+
+@lru_cache(maxsize=128)
+def _error_body(detail: str) -> bytes:
+    return jsonlib.dumps({"ok": False, "detail": detail})
+
+
+def error_response(detail: str, status: int) -> HttpResponse:
+    """Ответ с ошибкой; тело для каждого текста ошибки сериализуется один раз."""
+    return HttpResponse(_error_body(detail), status=status, content_type="application/json")
 
 
 def require_bot_api_key(view_func):
     @wraps(view_func)
     def wrapper(request: HttpRequest, *args, **kwargs):
-        expected_key = settings.BOT_API_KEY
-        if not expected_key:
-            return JsonResponse(
-                {"ok": False, "detail": "DJANGO_BOT_API_KEY is not configured"},
-                status=500,
-            )
+        if _EXPECTED_API_KEY is None:
+            return error_response("DJANGO_BOT_API_KEY is not configured", 500)
 
-        provided_key = request.headers.get("X-API-Key") or request.META.get("HTTP_X_API_KEY")
-        if provided_key != expected_key:
-            return JsonResponse({"ok": False, "detail": "Unauthorized"}, status=401)
+        # Сравнение за постоянное время: по длительности ответа нельзя подобрать ключ.
+        provided_key = request.META.get("HTTP_X_API_KEY", "").encode()
+        if not hmac.compare_digest(provided_key, _EXPECTED_API_KEY):
+            return error_response("Unauthorized", 401)
 
         return view_func(request, *args, **kwargs)
 
     return wrapper
 
 
-def health(_: HttpRequest) -> JsonResponse:
-    return JsonResponse({"ok": True, "service": "django-bot-backend"})
+def require_method(method: str):
+    """Отвечает 405 в JSON, если метод запроса не совпадает с ожидаемым."""
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            if request.method != method:
+                return error_response("Method not allowed", 405)
+            return view_func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def health(_: HttpRequest) -> HttpResponse:
+    return json_response({"ok": True, "service": "django-bot-backend"})
+
+
+USER_UPSERT_FIELDS = [
+    "username",
+    "first_name",
+    "last_name",
+    "language_code",
+    "phone_number",
+    "avatar_file_id",
+    "role",
+    "is_authenticated",
+    "authenticated_at",
+    "updated_at",
+]
 
 
 @csrf_exempt
 @require_bot_api_key
-def upsert_user(request: HttpRequest) -> JsonResponse:
-    if request.method != "POST":
-        return JsonResponse({"ok": False, "detail": "Method not allowed"}, status=405)
-
+@require_method("POST")
+def upsert_user(request: HttpRequest) -> HttpResponse:
     payload = parse_json_request(request)
     telegram_id = payload.get("telegram_id")
     if not telegram_id:
-        return JsonResponse({"ok": False, "detail": "telegram_id is required"}, status=400)
+        return error_response("telegram_id is required", 400)
 
-    try:
-        telegram_id = int(telegram_id)
-    except Exception:
-        return JsonResponse({"ok": False, "detail": "telegram_id must be int"}, status=400)
-
-    defaults = {
-        "username": str(payload.get("username") or ""),
-        "first_name": str(payload.get("first_name") or ""),
-        "last_name": str(payload.get("last_name") or ""),
-        "language_code": str(payload.get("language_code") or ""),
-        "phone_number": str(payload.get("phone_number") or ""),
-        "avatar_file_id": str(payload.get("avatar_file_id") or ""),
-        "role": normalize_role(payload.get("role")),
-        "is_authenticated": bool(payload.get("is_authenticated", False)),
-        "authenticated_at": parse_iso_datetime(payload.get("authenticated_at")),
-    }
+    telegram_id = _to_int(telegram_id)
+    if telegram_id is None:
+        return error_response("telegram_id must be int", 400)
 
-    obj, created = TelegramUser.objects.update_or_create(
+    user = TelegramUser(
         telegram_id=telegram_id,
-        defaults=defaults,
+        username=_s(payload.get("username")),
+        first_name=_s(payload.get("first_name")),
+        last_name=_s(payload.get("last_name")),
+        language_code=_s(payload.get("language_code")),
+        phone_number=_s(payload.get("phone_number")),
+        avatar_file_id=_s(payload.get("avatar_file_id")),
+        role=normalize_role(payload.get("role")),
+        is_authenticated=bool(payload.get("is_authenticated", False)),
+        authenticated_at=parse_iso_datetime(payload.get("authenticated_at")),
     )
-
-    return JsonResponse(
-        {
-            "ok": True,
-            "created": created,
-            "telegram_id": obj.telegram_id,
-            "role": obj.role,
-        }
+    # Один INSERT ... ON CONFLICT/ON DUPLICATE KEY UPDATE вместо SELECT + INSERT/UPDATE.
+    TelegramUser.objects.bulk_create(
+        [user],
+        update_conflicts=True,
+        unique_fields=_conflict_target("telegram_id"),
+        update_fields=USER_UPSERT_FIELDS,
     )
 
+    return json_response({"ok": True, "telegram_id": telegram_id, "role": user.role})
 
-@csrf_exempt
-@require_bot_api_key
-def create_action(request: HttpRequest) -> JsonResponse:
-    if request.method != "POST":
-        return JsonResponse({"ok": False, "detail": "Method not allowed"}, status=405)
 
-    payload = parse_json_request(request)
-    telegram_id = payload.get("telegram_id")
-    action = str(payload.get("action") or "").strip()
+def _build_action(payload: dict) -> UserAction:
+    """Событие пользователя из payload бота; ValueError — если обязательные поля некорректны."""
+    get = payload.get
+    telegram_id = get("telegram_id")
+    action = _s(get("action")).strip()
 
     if not telegram_id:
-        return JsonResponse({"ok": False, "detail": "telegram_id is required"}, status=400)
+        raise ValueError("telegram_id is required")
     if not action:
-        return JsonResponse({"ok": False, "detail": "action is required"}, status=400)
-
-    try:
-        telegram_id = int(telegram_id)
-    except Exception:
-        return JsonResponse({"ok": False, "detail": "telegram_id must be int"}, status=400)
-
-    user = TelegramUser.objects.filter(telegram_id=telegram_id).first()
+        raise ValueError("action is required")
 
-    event_time = parse_iso_datetime(payload.get("timestamp")) or timezone.now()
+    telegram_id = _to_int(telegram_id)
+    if telegram_id is None:
+        raise ValueError("telegram_id must be int")
 
-    action_obj = UserAction.objects.create(
-        user=user,
+    return UserAction(
         telegram_id=telegram_id,
-        username=str(payload.get("username") or ""),
-        first_name=str(payload.get("first_name") or ""),
-        last_name=str(payload.get("last_name") or ""),
+        username=_s(get("username")),
+        first_name=_s(get("first_name")),
+        last_name=_s(get("last_name")),
         action=action,
-        details=str(payload.get("details") or ""),
-        created_at=event_time,
+        details=_s(get("details")),
+        created_at=parse_iso_datetime(get("timestamp")) or timezone.now(),
         raw_payload=payload,
     )
 
-    return JsonResponse({"ok": True, "id": action_obj.id})
 
+@csrf_exempt
+@require_bot_api_key
+@require_method("POST")
+def create_action(request: HttpRequest) -> HttpResponse:
+    try:
+        action_obj = _build_action(parse_json_request(request))
+    except ValueError as exc:
+        return error_response(str(exc), 400)
 
-def _prepare_ad_defaults(payload: dict) -> dict:
-    author = payload.get("author") if isinstance(payload.get("author"), dict) else {}
-    status = str(payload.get("status") or AdItem.STATUS_ACTIVE).strip().lower()
-    if status not in {AdItem.STATUS_ACTIVE, AdItem.STATUS_INACTIVE, AdItem.STATUS_ARCHIVED}:
-        status = AdItem.STATUS_ACTIVE
+    # Автор подставляется подзапросом внутри INSERT: одно обращение к БД вместо SELECT + INSERT.
+    action_obj.user_id = Subquery(
+        TelegramUser.objects.filter(telegram_id=action_obj.telegram_id).values("pk")[:1]
+    )
+    # Тело запроса уже является JSON этого payload: сохраняем его как есть, без повторной сериализации.
+    action_obj.raw_payload = EncodedJSON(request.body)
+    action_obj.save(force_insert=True)
 
-    source_type = str(payload.get("source_type") or AdItem.SOURCE_MANUAL).strip().lower()
-    if source_type not in {AdItem.SOURCE_EXCEL, AdItem.SOURCE_MANUAL}:
-        source_type = AdItem.SOURCE_MANUAL
+    return json_response({"ok": True, "id": action_obj.id})
 
-    year = payload.get("year")
-    try:
-        year = int(year) if year is not None and str(year).strip() else None
-    except Exception:
-        year = None
 
-    price = payload.get("price", 0)
-    try:
-        price = int(price)
-    except Exception:
-        price = 0
+@csrf_exempt
+@require_bot_api_key
+@require_method("POST")
+def bulk_create_actions(request: HttpRequest) -> HttpResponse:
+    payload = parse_json_request(request)
+    items = payload.get("items")
 
-    author_id = author.get("id")
-    try:
-        author_id = int(author_id) if author_id is not None and str(author_id).strip() else None
-    except Exception:
-        author_id = None
+    if not isinstance(items, list):
+        return error_response("items must be a list", 400)
+
+    errors: list[dict] = []
+    actions: list[UserAction] = []
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": idx, "error": "item must be object"})
+            continue
+        try:
+            actions.append(_build_action(item))
+        except ValueError as exc:
+            errors.append({"index": idx, "error": str(exc)})
+
+    if actions:
+        # Один запрос на всех авторов пачки вместо подзапроса на каждое событие.
+        user_pk_map = dict(
+            TelegramUser.objects.filter(
+                telegram_id__in={action.telegram_id for action in actions}
+            ).values_list("telegram_id", "id")
+        )
+        for action in actions:
+            action.user_id = user_pk_map.get(action.telegram_id)
+        UserAction.objects.bulk_create(actions, batch_size=BULK_BATCH_SIZE)
+
+    return json_response({"ok": True, "created": len(actions), "errors": errors})
+
+
+AD_UPSERT_FIELDS = [
+    "source_type",
+    "external_id",
+    "title",
+    "category",
+    "price",
+    "year",
+    "details",
+    "location",
+    "image",
+    "status",
+    "author_telegram_id",
+    "author_username",
+    "author_first_name",
+    "author_last_name",
+    "created_at_remote",
+    "raw_payload",
+    "updated_at",
+]
+
+
+def _prepare_ad_defaults(payload: dict) -> dict:
+    get = payload.get
+    author = get("author")
+    if not isinstance(author, dict):
+        author = {}
+    author_get = author.get
+
+    status = _sl(get("status"))
+    if status not in _AD_STATUSES:
+        status = _DEFAULT_AD_STATUS
+
+    source_type = _sl(get("source_type"))
+    if source_type not in _AD_SOURCES:
+        source_type = _DEFAULT_AD_SOURCE
 
     return {
         "source_type": source_type,
-        "external_id": str(payload.get("external_id") or ""),
-        "title": str(payload.get("title") or "").strip(),
-        "category": str(payload.get("category") or "").strip(),
-        "price": price,
-        "year": year,
-        "details": str(payload.get("details") or ""),
-        "location": str(payload.get("location") or ""),
-        "image": str(payload.get("image") or ""),
+        "external_id": _s(get("external_id")),
+        "title": _s(get("title")).strip(),
+        "category": _s(get("category")).strip(),
+        "price": _to_int(get("price"), 0),
+        "year": _to_int(get("year")),
+        "details": _s(get("details")),
+        "location": _s(get("location")),
+        "image": _s(get("image")),
         "status": status,
-        "author_telegram_id": author_id,
-        "author_username": str(author.get("username") or ""),
-        "author_first_name": str(author.get("first_name") or ""),
-        "author_last_name": str(author.get("last_name") or ""),
-        "created_at_remote": parse_iso_datetime(payload.get("createdAt") or payload.get("created_at")),
+        "author_telegram_id": _to_int(author_get("id")),
+        "author_username": _s(author_get("username")),
+        "author_first_name": _s(author_get("first_name")),
+        "author_last_name": _s(author_get("last_name")),
+        "created_at_remote": parse_iso_datetime(get("createdAt") or get("created_at")),
         "raw_payload": payload,
     }
 
 
-def _upsert_ad_item(payload: dict):
-    ad_id = str(payload.get("id") or payload.get("ad_id") or "").strip()
+def _prepare_ad_item(payload: dict) -> tuple[str, dict]:
+    ad_id = _s(payload.get("id") or payload.get("ad_id")).strip()
     if not ad_id:
         raise ValueError("ad_id is required")
 
@@ -206,153 +361,190 @@ def _upsert_ad_item(payload: dict):
     if not defaults["title"]:
         raise ValueError("title is required")
 
-    return AdItem.objects.update_or_create(ad_id=ad_id, defaults=defaults)
+    return ad_id, defaults
+
+
+def _upsert_ad_item(payload: dict):
+    ad_id, defaults = _prepare_ad_item(payload)
+    # Старый raw_payload всё равно перезаписывается: не читаем и не распаковываем его.
+    return AdItem.objects.defer("raw_payload", "last_update").update_or_create(ad_id=ad_id, defaults=defaults)
 
 
 def _normalize_actor_role(role: str | None) -> str:
     return normalize_role(role)
 
 
-def _can_actor_manage_ad(actor_role: str, actor_telegram_id: int, ad_item: AdItem) -> tuple[bool, str]:
+def _manageable_ads(ad_id: str, actor_role: str, actor_telegram_id: int):
+    """QuerySet объявления, сужённый правами актора: права проверяются в WHERE, без отдельного SELECT."""
+    queryset = AdItem.objects.filter(ad_id=ad_id)
     if actor_role == TelegramUser.ROLE_ADMIN:
-        return True, ""
-
+        return queryset
     if actor_role == TelegramUser.ROLE_LEASING_COMPANY:
-        if ad_item.author_telegram_id != actor_telegram_id:
-            return False, "leasing_company can modify only own ads"
-        return True, ""
+        return queryset.filter(author_telegram_id=actor_telegram_id)
+    return queryset.none()
 
-    return False, "insufficient permissions"
+
+def _ad_access_error(ad_id: str, actor_role: str) -> HttpResponse:
+    """Ответ для случая, когда запрос с учётом прав не затронул ни одной строки."""
+    if not AdItem.objects.filter(ad_id=ad_id).exists():
+        return error_response("ad not found", 404)
+    if actor_role == TelegramUser.ROLE_LEASING_COMPANY:
+        return error_response("leasing_company can modify only own ads", 403)
+    return error_response("insufficient permissions", 403)
 
 
 def _parse_actor(payload: dict) -> tuple[int, str]:
     actor_telegram_id = payload.get("actor_telegram_id")
     if actor_telegram_id is None:
         raise ValueError("actor_telegram_id is required")
-    try:
-        actor_telegram_id = int(actor_telegram_id)
-    except Exception as exc:
-        raise ValueError("actor_telegram_id must be int") from exc
+    actor_telegram_id = _to_int(actor_telegram_id)
+    if actor_telegram_id is None:
+        raise ValueError("actor_telegram_id must be int")
 
     actor_role = _normalize_actor_role(payload.get("actor_role"))
     return actor_telegram_id, actor_role
 
 
 def _extract_ad_update_fields(updates: dict) -> tuple[dict, str | None]:
+    # Одно обращение к словарю на поле: get(key, _MISSING) вместо пары `key in updates` + get().
     cleaned: dict = {}
+    get = updates.get
 
-    if "title" in updates:
-        title = str(updates.get("title") or "").strip()
+    value = get("title", _MISSING)
+    if value is not _MISSING:
+        title = _s(value).strip()
         if not title:
             return {}, "title must not be empty"
         cleaned["title"] = title
 
-    if "category" in updates:
-        cleaned["category"] = str(updates.get("category") or "").strip()
+    value = get("category", _MISSING)
+    if value is not _MISSING:
+        cleaned["category"] = _s(value).strip()
 
-    if "price" in updates:
-        try:
-            cleaned["price"] = int(updates.get("price") or 0)
-        except Exception:
-            cleaned["price"] = 0
+    value = get("price", _MISSING)
+    if value is not _MISSING:
+        cleaned["price"] = _to_int(value, 0)
 
-    if "year" in updates:
-        year = updates.get("year")
-        try:
-            cleaned["year"] = int(year) if year is not None and str(year).strip() else None
-        except Exception:
-            cleaned["year"] = None
+    value = get("year", _MISSING)
+    if value is not _MISSING:
+        cleaned["year"] = _to_int(value)
 
-    if "details" in updates:
-        cleaned["details"] = str(updates.get("details") or "")
+    value = get("details", _MISSING)
+    if value is not _MISSING:
+        cleaned["details"] = _s(value)
 
-    if "location" in updates:
-        cleaned["location"] = str(updates.get("location") or "")
+    value = get("location", _MISSING)
+    if value is not _MISSING:
+        cleaned["location"] = _s(value)
 
-    if "image" in updates:
-        cleaned["image"] = str(updates.get("image") or "")
+    value = get("image", _MISSING)
+    if value is not _MISSING:
+        cleaned["image"] = _s(value)
 
-    if "status" in updates:
-        status = str(updates.get("status") or "").strip().lower()
-        if status in {AdItem.STATUS_ACTIVE, AdItem.STATUS_INACTIVE, AdItem.STATUS_ARCHIVED}:
+    value = get("status", _MISSING)
+    if value is not _MISSING:
+        status = _sl(value)
+        if status in _AD_STATUSES:
             cleaned["status"] = status
 
-    if "external_id" in updates:
-        cleaned["external_id"] = str(updates.get("external_id") or "")
+    value = get("external_id", _MISSING)
+    if value is not _MISSING:
+        cleaned["external_id"] = _s(value)
 
-    if "source_type" in updates:
-        source_type = str(updates.get("source_type") or "").strip().lower()
-        if source_type in {AdItem.SOURCE_EXCEL, AdItem.SOURCE_MANUAL}:
+    value = get("source_type", _MISSING)
+    if value is not _MISSING:
+        source_type = _sl(value)
+        if source_type in _AD_SOURCES:
             cleaned["source_type"] = source_type
 
-    created_at_remote = updates.get("createdAt") if "createdAt" in updates else updates.get("created_at")
-    if "createdAt" in updates or "created_at" in updates:
-        cleaned["created_at_remote"] = parse_iso_datetime(created_at_remote)
+    value = get("createdAt", _MISSING)
+    if value is _MISSING:
+        value = get("created_at", _MISSING)
+    if value is not _MISSING:
+        cleaned["created_at_remote"] = parse_iso_datetime(value)
 
-    if "author" in updates and isinstance(updates.get("author"), dict):
-        author = updates.get("author", {})
-        author_id = author.get("id")
-        try:
-            author_id = int(author_id) if author_id is not None and str(author_id).strip() else None
-        except Exception:
-            author_id = None
-        cleaned["author_telegram_id"] = author_id
-        cleaned["author_username"] = str(author.get("username") or "")
-        cleaned["author_first_name"] = str(author.get("first_name") or "")
-        cleaned["author_last_name"] = str(author.get("last_name") or "")
+    author = get("author")
+    if isinstance(author, dict):
+        author_get = author.get
+        cleaned["author_telegram_id"] = _to_int(author_get("id"))
+        cleaned["author_username"] = _s(author_get("username"))
+        cleaned["author_first_name"] = _s(author_get("first_name"))
+        cleaned["author_last_name"] = _s(author_get("last_name"))
 
     return cleaned, None
 
 
 @csrf_exempt
 @require_bot_api_key
-def upsert_ad(request: HttpRequest) -> JsonResponse:
-    if request.method != "POST":
-        return JsonResponse({"ok": False, "detail": "Method not allowed"}, status=405)
-
+@require_method("POST")
+def upsert_ad(request: HttpRequest) -> HttpResponse:
     payload = parse_json_request(request)
 
     try:
         obj, created = _upsert_ad_item(payload)
     except ValueError as exc:
-        return JsonResponse({"ok": False, "detail": str(exc)}, status=400)
+        return error_response(str(exc), 400)
 
-    return JsonResponse({"ok": True, "created": created, "ad_id": obj.ad_id})
+    return json_response({"ok": True, "created": created, "ad_id": obj.ad_id})
 
 
 @csrf_exempt
 @require_bot_api_key
-def bulk_upsert_ads(request: HttpRequest) -> JsonResponse:
-    if request.method != "POST":
-        return JsonResponse({"ok": False, "detail": "Method not allowed"}, status=405)
-
+@require_method("POST")
+def bulk_upsert_ads(request: HttpRequest) -> HttpResponse:
     payload = parse_json_request(request)
     items = payload.get("items")
 
     if not isinstance(items, list):
-        return JsonResponse({"ok": False, "detail": "items must be a list"}, status=400)
+        return error_response("items must be a list", 400)
 
     created_count = 0
     updated_count = 0
     errors: list[dict] = []
+    # ad_id валидных элементов в порядке запроса; при повторе ad_id побеждает последний элемент.
+    accepted_ids: list[str] = []
+    prepared: dict[str, dict] = {}
+
+    # Инварианты цикла связываются с локальными именами один раз, а не на каждой итерации.
+    prepare_item = _prepare_ad_item
+    add_error = errors.append
+    accept_id = accepted_ids.append
+
+    # Фаза 1: валидация в чистом Python, без открытой транзакции.
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            add_error({"index": idx, "error": "item must be object"})
+            continue
+        try:
+            ad_id, defaults = prepare_item(item)
+        except ValueError as exc:
+            add_error({"index": idx, "error": str(exc)})
+            continue
+        accept_id(ad_id)
+        prepared[ad_id] = defaults
+
+    # Фаза 2: транзакция держится только на время обращений к БД.
+    if prepared:
+        ads = [AdItem(ad_id=ad_id, **defaults) for ad_id, defaults in prepared.items()]
+        with transaction.atomic():
+            known_ids = set(AdItem.objects.filter(ad_id__in=prepared).values_list("ad_id", flat=True))
+            AdItem.objects.bulk_create(
+                ads,
+                batch_size=BULK_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=_conflict_target("ad_id"),
+                update_fields=AD_UPSERT_FIELDS,
+            )
 
-    with transaction.atomic():
-        for idx, item in enumerate(items):
-            if not isinstance(item, dict):
-                errors.append({"index": idx, "error": "item must be object"})
-                continue
-            try:
-                _, created = _upsert_ad_item(item)
-            except ValueError as exc:
-                errors.append({"index": idx, "error": str(exc)})
-                continue
-
-            if created:
-                created_count += 1
-            else:
+        # Повтор ad_id в запросе считается обновлением: первый раз он уже создан.
+        for ad_id in accepted_ids:
+            if ad_id in known_ids:
                 updated_count += 1
+            else:
+                created_count += 1
+            known_ids.add(ad_id)
 
-    return JsonResponse(
+    return json_response(
         {
             "ok": True,
             "created": created_count,
@@ -364,83 +556,65 @@ def bulk_upsert_ads(request: HttpRequest) -> JsonResponse:
 
 @csrf_exempt
 @require_bot_api_key
-def update_ad_with_permissions(request: HttpRequest) -> JsonResponse:
-    if request.method != "POST":
-        return JsonResponse({"ok": False, "detail": "Method not allowed"}, status=405)
-
+@require_method("POST")
+def update_ad_with_permissions(request: HttpRequest) -> HttpResponse:
     payload = parse_json_request(request)
-    ad_id = str(payload.get("ad_id") or payload.get("id") or "").strip()
+    ad_id = _s(payload.get("ad_id") or payload.get("id")).strip()
     if not ad_id:
-        return JsonResponse({"ok": False, "detail": "ad_id is required"}, status=400)
+        return error_response("ad_id is required", 400)
 
     updates = payload.get("updates")
     if not isinstance(updates, dict):
-        return JsonResponse({"ok": False, "detail": "updates must be object"}, status=400)
+        return error_response("updates must be object", 400)
 
     try:
         actor_telegram_id, actor_role = _parse_actor(payload)
     except ValueError as exc:
-        return JsonResponse({"ok": False, "detail": str(exc)}, status=400)
-
-    ad_item = AdItem.objects.filter(ad_id=ad_id).first()
-    if not ad_item:
-        return JsonResponse({"ok": False, "detail": "ad not found"}, status=404)
-
-    allowed, reason = _can_actor_manage_ad(actor_role, actor_telegram_id, ad_item)
-    if not allowed:
-        return JsonResponse({"ok": False, "detail": reason}, status=403)
+        return error_response(str(exc), 400)
 
     cleaned_updates, error_message = _extract_ad_update_fields(updates)
     if error_message:
-        return JsonResponse({"ok": False, "detail": error_message}, status=400)
+        return error_response(error_message, 400)
     if not cleaned_updates:
-        return JsonResponse({"ok": False, "detail": "no updatable fields"}, status=400)
+        return error_response("no updatable fields", 400)
 
-    existing_payload = ad_item.raw_payload if isinstance(ad_item.raw_payload, dict) else {}
-    existing_payload["last_update"] = updates
-    cleaned_updates["raw_payload"] = existing_payload
-    for key, value in cleaned_updates.items():
-        setattr(ad_item, key, value)
-    ad_item.save(update_fields=list(cleaned_updates.keys()) + ["updated_at"])
+    cleaned_updates["last_update"] = updates
+    # Права проверяются в WHERE: UPDATE затрагивает строку, только если актор может её менять.
+    updated = _manageable_ads(ad_id, actor_role, actor_telegram_id).update(
+        **cleaned_updates, updated_at=timezone.now()
+    )
+    if not updated:
+        return _ad_access_error(ad_id, actor_role)
 
-    return JsonResponse({"ok": True, "ad_id": ad_item.ad_id})
+    return json_response({"ok": True, "ad_id": ad_id})
 
 
 @csrf_exempt
 @require_bot_api_key
-def delete_ad_with_permissions(request: HttpRequest) -> JsonResponse:
-    if request.method != "POST":
-        return JsonResponse({"ok": False, "detail": "Method not allowed"}, status=405)
-
+@require_method("POST")
+def delete_ad_with_permissions(request: HttpRequest) -> HttpResponse:
     payload = parse_json_request(request)
-    ad_id = str(payload.get("ad_id") or payload.get("id") or "").strip()
+    ad_id = _s(payload.get("ad_id") or payload.get("id")).strip()
     if not ad_id:
-        return JsonResponse({"ok": False, "detail": "ad_id is required"}, status=400)
+        return error_response("ad_id is required", 400)
 
     try:
         actor_telegram_id, actor_role = _parse_actor(payload)
     except ValueError as exc:
-        return JsonResponse({"ok": False, "detail": str(exc)}, status=400)
+        return error_response(str(exc), 400)
 
-    ad_item = AdItem.objects.filter(ad_id=ad_id).first()
-    if not ad_item:
-        return JsonResponse({"ok": False, "detail": "ad not found"}, status=404)
+    deleted, _ = _manageable_ads(ad_id, actor_role, actor_telegram_id).delete()
+    if not deleted:
+        return _ad_access_error(ad_id, actor_role)
 
-    allowed, reason = _can_actor_manage_ad(actor_role, actor_telegram_id, ad_item)
-    if not allowed:
-        return JsonResponse({"ok": False, "detail": reason}, status=403)
-
-    ad_item.delete()
-    return JsonResponse({"ok": True, "ad_id": ad_id})
+    return json_response({"ok": True, "ad_id": ad_id})
 
 
 @require_bot_api_key
-def user_role(request: HttpRequest, telegram_id: int) -> JsonResponse:
-    if request.method != "GET":
-        return JsonResponse({"ok": False, "detail": "Method not allowed"}, status=405)
-
-    user = TelegramUser.objects.filter(telegram_id=telegram_id).first()
-    if not user:
-        return JsonResponse({"ok": False, "detail": "User not found"}, status=404)
+@require_method("GET")
+def user_role(request: HttpRequest, telegram_id: int) -> HttpResponse:
+    role = TelegramUser.objects.filter(telegram_id=telegram_id).values_list("role", flat=True).first()
+    if role is None:
+        return error_response("User not found", 404)
 
-    return JsonResponse({"ok": True, "telegram_id": telegram_id, "role": user.role})
+    return json_response({"ok": True, "telegram_id": telegram_id, "role": role})
@@ -1,12 +1,16 @@
+import asyncio
 import logging
 import json
 import os
 import html
 import re
+import threading
+import time
+from collections import defaultdict, deque
 from datetime import datetime
+from functools import lru_cache, partial
 from pathlib import Path
-from urllib import error as urllib_error
-from urllib import request as urllib_request
+from typing import NamedTuple
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 from telegram import (
     Update,
@@ -18,7 +22,19 @@ from telegram import (
     ReplyKeyboardRemove,
 )
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters
+import numpy as np
 import pandas as pd
+import httpx
+
+try:
+    import orjson
+except ImportError:  # orjson не установлен — используем стандартный json
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # uvloop нет (например, на Windows) — остаётся стандартный цикл asyncio
+    uvloop = None
 
 # Импорт ядра парсера (без GUI) из корня проекта
 ROOT_DIR = Path(__file__).resolve().parent.parent
@@ -62,16 +78,31 @@ try:
 except ValueError:
     DJANGO_BACKEND_TIMEOUT = 5.0
 
-# Путь к файлу логов пользователей
-USERS_LOG_FILE = "users_log.json"
+# Путь к файлу логов пользователей (JSON Lines: одна запись на строку)
+USERS_LOG_FILE = "users_log.jsonl"
+LEGACY_USERS_LOG_FILE = "users_log.json"
+USERS_LOG_MAX_ENTRIES = 1000
+USERS_LOG_TRIM_EVERY = 100
+# Записи лога копятся в памяти и дописываются в файл пачкой из фоновой задачи.
+USERS_LOG_BATCH_SIZE = 100
+USERS_LOG_FLUSH_INTERVAL = 0.5
+_users_log_writes = 0
+_users_log_buffer: list[bytes] = []
+_users_log_lock = threading.Lock()
+_users_log_flush_task: asyncio.Task | None = None
 
 # ID администраторов (только для команды /stats)
-ADMIN_IDS = [1729659964]
+ADMIN_IDS: frozenset[int] = frozenset({1729659964})
 ADMIN_PRESET_USERS = {
     1729659964: {
         "phone_number": "+79326157743",
     }
 }
+EXCEL_EXTENSIONS = frozenset({".xlsx", ".xls", ".xlsm"})
+# Bot API отдаёт через getFile файлы не больше 20 МБ.
+MAX_EXCEL_BYTES = 20 * 1024 * 1024
+# Таймаут скачивания Excel и отправки сгенерированного index.html (по умолчанию у PTB 5 с / 20 с).
+PARSER_FILE_TIMEOUT = 120.0
 PARSER_OUTPUT_DIR = Path(__file__).resolve().parent / "parsed_output"
 PARSER_TMP_DIR = Path(__file__).resolve().parent / "tmp_uploads"
 ADS_FEED_FILE = Path(__file__).resolve().parent / "ads_feed.json"
@@ -80,7 +111,7 @@ AUTH_USERS_FILE = Path(__file__).resolve().parent / "auth_users.json"
 USER_ROLE_USER = "user"
 USER_ROLE_LEASING_COMPANY = "leasing_company"
 USER_ROLE_ADMIN = "admin"
-AD_MANAGEMENT_ROLES = {USER_ROLE_ADMIN, USER_ROLE_LEASING_COMPANY}
+AD_MANAGEMENT_ROLES = frozenset({USER_ROLE_ADMIN, USER_ROLE_LEASING_COMPANY})
 ROLE_LABELS = {
     USER_ROLE_USER: "Пользователь",
     USER_ROLE_LEASING_COMPANY: "Лизинговая компания",
@@ -89,6 +120,92 @@ ROLE_LABELS = {
 BOT_BUILD_VERSION = os.getenv("BOT_BUILD_VERSION", datetime.now().strftime("%Y%m%d%H%M%S"))
 
 
+class UserCtx(NamedTuple):
+    """Данные пользователя Telegram для логов и авторства объявлений."""
+    id: int
+    username: str | None
+    first_name: str | None
+    last_name: str | None
+
+
+def user_ctx(user) -> UserCtx:
+    return UserCtx(user.id, user.username, user.first_name, user.last_name)
+
+
+# Формат -> (секунда, строка): в пределах одной секунды strftime не повторяется.
+_TIMESTAMP_CACHE: dict[str, tuple[int, str]] = {}
+
+
+def format_now(fmt: str) -> str:
+    """Текущее локальное время в формате fmt с точностью до секунды."""
+    now = int(time.time())
+    cached = _TIMESTAMP_CACHE.get(fmt)
+    if cached is not None and cached[0] == now:
+        return cached[1]
+    formatted = time.strftime(fmt, time.localtime(now))
+    _TIMESTAMP_CACHE[fmt] = (now, formatted)
+    return formatted
+
+
+def json_dumps(value, indent: bool = False) -> bytes:
+    """Сериализует в JSON (UTF-8 байты, без экранирования кириллицы)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(value, option=option)
+    return json.dumps(value, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def json_loads(data: bytes | str):
+    """Разбирает JSON; ошибки формата — json.JSONDecodeError (orjson наследует его)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Разобранные JSON-файлы: путь -> ((st_mtime_ns, st_size), данные).
+_JSON_FILE_CACHE: dict[str, tuple[tuple[int, int], object]] = {}
+
+
+def _file_stamp(path) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_json_file(path):
+    """
+    Читает JSON-файл, повторно разбирая его только после изменения на диске.
+
+    Возвращается общий закэшированный объект: изменив его, вызывающий код
+    должен сохранить результат через write_json_file.
+    """
+    key = str(path)
+    stamp = _file_stamp(path)
+    cached = _JSON_FILE_CACHE.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    data = json_loads(Path(path).read_bytes())
+    _JSON_FILE_CACHE[key] = (stamp, data)
+    return data
+
+
+def atomic_write_bytes(path, data: bytes) -> None:
+    """Пишет во временный файл и подменяет им исходный: читатели не увидят недописанный файл."""
+    tmp_path = Path(f"{path}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def write_json_file(path, data) -> None:
+    """Атомарно записывает JSON-файл и сразу кладёт записанные данные в кэш."""
+    key = str(path)
+    payload = json_dumps(data, indent=True)
+    _JSON_FILE_CACHE.pop(key, None)
+    atomic_write_bytes(path, payload)
+    _JSON_FILE_CACHE[key] = (_file_stamp(path), data)
+
+
 def is_parser_enabled() -> bool:
     return PARSER_AVAILABLE and all([read_flexible, prepare_cards, generate_site, config_manager, column_mapper])
 
@@ -97,6 +214,22 @@ def backend_sync_enabled() -> bool:
     return bool(DJANGO_BACKEND_URL and DJANGO_BACKEND_API_KEY)
 
 
+_backend_client: httpx.Client | None = None
+
+
+def get_backend_client() -> httpx.Client:
+    """Общий HTTP-клиент к Django backend: keep-alive соединения переиспользуются между запросами."""
+    global _backend_client
+    if _backend_client is None:
+        _backend_client = httpx.Client(
+            base_url=DJANGO_BACKEND_URL,
+            headers={"X-API-Key": DJANGO_BACKEND_API_KEY},
+            timeout=DJANGO_BACKEND_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=20),
+        )
+    return _backend_client
+
+
 def backend_request(
     method: str,
     path: str,
@@ -107,52 +240,147 @@ def backend_request(
     if not backend_sync_enabled():
         return None
 
-    data = None
-    headers = {"X-API-Key": DJANGO_BACKEND_API_KEY}
+    content = None
+    headers = None
     if payload is not None:
-        headers["Content-Type"] = "application/json; charset=utf-8"
-        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-
-    request_url = f"{DJANGO_BACKEND_URL}{path}"
-    request = urllib_request.Request(
-        url=request_url,
-        data=data,
-        headers=headers,
-        method=method.upper()
-    )
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        content = json_dumps(payload)
 
     try:
-        with urllib_request.urlopen(request, timeout=DJANGO_BACKEND_TIMEOUT) as response:
-            raw = response.read().decode("utf-8")
-            if not raw:
-                return {}
-            try:
-                return json.loads(raw)
-            except Exception:
-                return {"raw": raw}
-    except urllib_error.HTTPError as exc:
-        if suppress_not_found and exc.code == 404:
+        response = get_backend_client().request(method.upper(), path, content=content, headers=headers)
+    except Exception as exc:
+        logger.warning("Backend sync failed %s %s: %s", method, path, exc)
+        return None
+
+    if response.is_error:
+        if suppress_not_found and response.status_code == 404:
             return None
-        body = exc.read().decode("utf-8", errors="ignore")
         logger.warning(
             "Backend sync failed %s %s: HTTP %s %s",
             method,
             path,
-            exc.code,
-            body[:300]
+            response.status_code,
+            # Декодируем только логируемый фрагмент, а не всё тело ответа.
+            response.content[:300].decode("utf-8", errors="ignore")
         )
-    except Exception as exc:
-        logger.warning("Backend sync failed %s %s: %s", method, path, exc)
-    return None
+        return None
+
+    raw = response.content
+    if not raw:
+        return {}
+    try:
+        return json_loads(raw)
+    except Exception:
+        return {"raw": raw.decode("utf-8", errors="ignore")}
+
+
+# Очередь фоновой синхронизации с backend: (method, path, payload).
+_backend_queue: asyncio.Queue | None = None
+_backend_loop: asyncio.AbstractEventLoop | None = None
+_backend_worker_task: asyncio.Task | None = None
+_action_flush_task: asyncio.Task | None = None
+BACKEND_QUEUE_DRAIN_TIMEOUT = 10.0
+
+# События пользователей копятся и уходят в backend пачками через /api/actions/bulk/.
+ACTION_BATCH_SIZE = 50
+ACTION_FLUSH_INTERVAL = 2.0
+_action_buffer: list[dict] = []
+_action_buffer_lock = threading.Lock()
+
+
+def enqueue_backend_request(method: str, path: str, payload: dict | None = None) -> None:
+    """Ставит запрос к backend в фоновую очередь, не блокируя обработчик Telegram."""
+    if not backend_sync_enabled():
+        return
+    if _backend_queue is None or _backend_loop is None:
+        # Воркер не запущен (например, вне run_polling) — выполняем запрос сразу.
+        backend_request(method, path, payload)
+        return
+    # call_soon_threadsafe: постановка безопасна и из потоков asyncio.to_thread.
+    _backend_loop.call_soon_threadsafe(_backend_queue.put_nowait, (method, path, payload))
+
+
+async def _backend_sync_worker(queue: asyncio.Queue) -> None:
+    while True:
+        method, path, payload = await queue.get()
+        try:
+            await asyncio.to_thread(backend_request, method, path, payload)
+        except Exception as exc:
+            logger.warning("Backend sync failed %s %s: %s", method, path, exc)
+        finally:
+            queue.task_done()
+
+
+def flush_user_actions() -> None:
+    """Отправляет накопленные события одним bulk-запросом."""
+    with _action_buffer_lock:
+        if not _action_buffer:
+            return
+        items = _action_buffer.copy()
+        _action_buffer.clear()
+    enqueue_backend_request("POST", "/api/actions/bulk/", {"items": items})
+
+
+async def _action_flush_loop() -> None:
+    # Периодический сброс, чтобы при низкой активности события не залёживались в буфере.
+    while True:
+        await asyncio.sleep(ACTION_FLUSH_INTERVAL)
+        flush_user_actions()
+
+
+async def start_backend_sync(application: Application) -> None:
+    """post_init: запускает воркер фоновой синхронизации."""
+    global _backend_queue, _backend_loop, _backend_worker_task, _action_flush_task
+    if not backend_sync_enabled():
+        return
+    _backend_loop = asyncio.get_running_loop()
+    _backend_queue = asyncio.Queue()
+    # Не через application.create_task: Application.stop() ждёт такие задачи, а они бесконечные.
+    _backend_worker_task = _backend_loop.create_task(_backend_sync_worker(_backend_queue))
+    _action_flush_task = _backend_loop.create_task(_action_flush_loop())
+
+
+async def stop_backend_sync(application: Application) -> None:
+    """post_stop: досылает накопленные запросы и останавливает воркер."""
+    global _backend_queue, _backend_loop, _backend_worker_task, _action_flush_task
+    if _backend_worker_task is None:
+        return
+    _action_flush_task.cancel()
+    flush_user_actions()
+    try:
+        await asyncio.wait_for(_backend_queue.join(), timeout=BACKEND_QUEUE_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Backend sync: %s requests dropped on shutdown", _backend_queue.qsize())
+    _backend_worker_task.cancel()
+    _backend_queue = None
+    _backend_loop = None
+    _backend_worker_task = None
+    _action_flush_task = None
+
+
+async def start_background_tasks(application: Application) -> None:
+    """post_init: фоновая запись лога пользователей и синхронизация с backend."""
+    start_users_log_flusher()
+    await start_backend_sync(application)
+
+
+async def stop_background_tasks(application: Application) -> None:
+    """post_stop: дописывает лог и досылает запросы в backend."""
+    stop_users_log_flusher()
+    await stop_backend_sync(application)
+
+
+_ROLE_ALIASES = {
+    **dict.fromkeys(
+        ("leasing", "leasing_company", "лизинговая", "лизинговая компания", "лизинговая_компания"),
+        USER_ROLE_LEASING_COMPANY,
+    ),
+    **dict.fromkeys(("admin", "админ", "администратор"), USER_ROLE_ADMIN),
+}
 
 
 def normalize_user_role(role: str | None) -> str:
-    normalized = str(role or USER_ROLE_USER).strip().lower()
-    if normalized in {"leasing", "leasing_company", "лизинговая", "лизинговая компания", "лизинговая_компания"}:
-        return USER_ROLE_LEASING_COMPANY
-    if normalized in {"admin", "админ", "администратор"}:
-        return USER_ROLE_ADMIN
-    return USER_ROLE_USER
+    return _ROLE_ALIASES.get(str(role or USER_ROLE_USER).strip().lower(), USER_ROLE_USER)
 
 
 def fetch_backend_user_role(user_id: int) -> str | None:
@@ -182,7 +410,7 @@ def sync_user_to_backend(user_record: dict) -> None:
         "is_authenticated": bool(user_record.get("is_authenticated")),
         "authenticated_at": user_record.get("authenticated_at"),
     }
-    backend_request("POST", "/api/users/upsert/", payload)
+    enqueue_backend_request("POST", "/api/users/upsert/", payload)
 
 
 def sync_user_action_to_backend(log_entry: dict) -> None:
@@ -195,42 +423,55 @@ def sync_user_action_to_backend(log_entry: dict) -> None:
         "details": log_entry.get("details"),
         "timestamp": log_entry.get("timestamp"),
     }
-    backend_request("POST", "/api/actions/", payload)
+    if _backend_queue is None:
+        # Без фонового воркера буферизовать некому — отправляем событие сразу.
+        enqueue_backend_request("POST", "/api/actions/", payload)
+        return
+    with _action_buffer_lock:
+        _action_buffer.append(payload)
+        batch_ready = len(_action_buffer) >= ACTION_BATCH_SIZE
+    if batch_ready:
+        flush_user_actions()
+
+
+BACKEND_AD_FIELDS = (
+    "id",
+    "source_type",
+    "external_id",
+    "title",
+    "category",
+    "price",
+    "year",
+    "details",
+    "location",
+    "image",
+    "status",
+    "createdAt",
+)
+BACKEND_AUTHOR_FIELDS = ("id", "username", "first_name", "last_name")
+BACKEND_ADS_CHUNK_SIZE = 500
 
 
 def serialize_ad_for_backend(ad: dict) -> dict:
-    author = ad.get("author") if isinstance(ad.get("author"), dict) else {}
-    return {
-        "id": ad.get("id"),
-        "source_type": ad.get("source_type"),
-        "external_id": ad.get("external_id"),
-        "title": ad.get("title"),
-        "category": ad.get("category"),
-        "price": ad.get("price"),
-        "year": ad.get("year"),
-        "details": ad.get("details"),
-        "location": ad.get("location"),
-        "image": ad.get("image"),
-        "status": ad.get("status"),
-        "createdAt": ad.get("createdAt"),
-        "author": {
-            "id": author.get("id"),
-            "username": author.get("username"),
-            "first_name": author.get("first_name"),
-            "last_name": author.get("last_name"),
-        }
-    }
+    # dict(zip(...)) с bound-методом get собирает словарь в C, без литерала на 12 полей.
+    payload = dict(zip(BACKEND_AD_FIELDS, map(ad.get, BACKEND_AD_FIELDS)))
+    author = ad.get("author")
+    if not isinstance(author, dict):
+        author = {}
+    payload["author"] = dict(zip(BACKEND_AUTHOR_FIELDS, map(author.get, BACKEND_AUTHOR_FIELDS)))
+    return payload
 
 
 def sync_ad_to_backend(ad: dict) -> None:
-    backend_request("POST", "/api/ads/upsert/", serialize_ad_for_backend(ad))
+    enqueue_backend_request("POST", "/api/ads/upsert/", serialize_ad_for_backend(ad))
 
 
 def sync_ads_to_backend(items: list[dict]) -> None:
-    if not items:
-        return
-    payload = {"items": [serialize_ad_for_backend(item) for item in items]}
-    backend_request("POST", "/api/ads/bulk-upsert/", payload)
+    # Пачками: ни бот, ни backend не держат в памяти и в одной транзакции всю выгрузку.
+    for start in range(0, len(items), BACKEND_ADS_CHUNK_SIZE):
+        chunk = items[start:start + BACKEND_ADS_CHUNK_SIZE]
+        payload = {"items": [serialize_ad_for_backend(item) for item in chunk]}
+        enqueue_backend_request("POST", "/api/ads/bulk-upsert/", payload)
 
 
 def sync_update_ad_with_permissions(ad_id: str, actor_user_id: int, actor_role: str, updates: dict) -> None:
@@ -240,7 +481,7 @@ def sync_update_ad_with_permissions(ad_id: str, actor_user_id: int, actor_role:
         "actor_role": actor_role,
         "updates": updates,
     }
-    backend_request("POST", "/api/ads/update/", payload)
+    enqueue_backend_request("POST", "/api/ads/update/", payload)
 
 
 def sync_delete_ad_with_permissions(ad_id: str, actor_user_id: int, actor_role: str) -> None:
@@ -249,62 +490,151 @@ def sync_delete_ad_with_permissions(ad_id: str, actor_user_id: int, actor_role:
         "actor_telegram_id": int(actor_user_id),
         "actor_role": actor_role,
     }
-    backend_request("POST", "/api/ads/delete/", payload)
+    enqueue_backend_request("POST", "/api/ads/delete/", payload)
+
+
+# Роли меняются редко: результат запроса роли кэшируется на ROLE_CACHE_TTL секунд.
+ROLE_CACHE_TTL = 60.0
+_role_cache: dict[int, tuple[str, float]] = {}
+# Одновременные запросы роли одного пользователя схлопываются в один запрос к backend.
+_role_locks: dict[int, asyncio.Lock] = {}
+_role_refresh_tasks: dict[int, asyncio.Task] = {}
+
+
+def invalidate_user_role(user_id: int) -> None:
+    _role_cache.pop(user_id, None)
+
+
+def _cached_user_role(user_id: int) -> str | None:
+    cached = _role_cache.get(user_id)
+    if cached is not None and time.monotonic() - cached[1] < ROLE_CACHE_TTL:
+        return cached[0]
+    return None
+
+
+def _local_user_role(user_id: int) -> str:
+    auth_record = get_authenticated_user(user_id)
+    return normalize_user_role(auth_record.get("role")) if auth_record else USER_ROLE_USER
+
+
+def _fetch_user_role(user_id: int) -> str:
+    """Блокирующий запрос роли (backend, затем auth_users.json) с записью в кэш."""
+    role = fetch_backend_user_role(user_id) or _local_user_role(user_id)
+    _role_cache[user_id] = (role, time.monotonic())
+    return role
+
+
+async def resolve_user_role(user_id: int) -> str:
+    """Актуальная роль для проверок прав: запрос к backend выполняется вне event loop."""
+    if user_id in ADMIN_IDS:
+        return USER_ROLE_ADMIN
+    role = _cached_user_role(user_id)
+    if role is not None:
+        return role
+    lock = _role_locks.setdefault(user_id, asyncio.Lock())
+    async with lock:
+        role = _cached_user_role(user_id)
+        if role is not None:
+            return role
+        return await asyncio.to_thread(_fetch_user_role, user_id)
+
+
+def _schedule_role_refresh(loop: asyncio.AbstractEventLoop, user_id: int) -> None:
+    if user_id in _role_refresh_tasks:
+        return
+    task = loop.create_task(resolve_user_role(user_id))
+    _role_refresh_tasks[user_id] = task
+    task.add_done_callback(lambda _: _role_refresh_tasks.pop(user_id, None))
 
 
 def get_user_role(user_id: int) -> str:
+    """
+    Роль для отрисовки меню и ссылок на WebApp.
+
+    Внутри event loop не ждёт backend: при промахе кэша возвращает роль из auth_users.json
+    и обновляет кэш в фоне. Для проверок прав используйте resolve_user_role.
+    """
     if user_id in ADMIN_IDS:
         return USER_ROLE_ADMIN
-    backend_role = fetch_backend_user_role(user_id)
-    if backend_role:
-        return backend_role
-    auth_record = get_authenticated_user(user_id)
-    if not auth_record:
-        return USER_ROLE_USER
-    return normalize_user_role(auth_record.get("role"))
+    role = _cached_user_role(user_id)
+    if role is not None:
+        return role
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Вне event loop блокироваться можно.
+        return _fetch_user_role(user_id)
+    _schedule_role_refresh(loop, user_id)
+    return _local_user_role(user_id)
 
 
-def can_user_manage_ads(user_id: int) -> bool:
-    return get_user_role(user_id) in AD_MANAGEMENT_ROLES
+async def can_user_manage_ads(user_id: int) -> bool:
+    return await resolve_user_role(user_id) in AD_MANAGEMENT_ROLES
 
 
-def build_web_app_url(user_id: int | None = None) -> str:
-    role = USER_ROLE_USER if user_id is None else get_user_role(user_id)
-    parsed = urlparse(HTML_FILE_URL)
-    query = dict(parse_qsl(parsed.query, keep_blank_values=True))
+# Базовый URL WebApp разбирается один раз при импорте.
+_PARSED_HTML_URL = urlparse(HTML_FILE_URL)
+_HTML_URL_BASE_QUERY = dict(parse_qsl(_PARSED_HTML_URL.query, keep_blank_values=True))
+
+
+@lru_cache(maxsize=4096)
+def _build_web_app_url_cached(user_id: int | None, role: str) -> str:
+    # Роль входит в ключ кэша: после смены роли URL просто собирается заново.
+    query = dict(_HTML_URL_BASE_QUERY)
     query["v"] = BOT_BUILD_VERSION
     query["role"] = role
     if user_id is not None:
         query["uid"] = str(user_id)
-    return urlunparse(parsed._replace(query=urlencode(query)))
+    return urlunparse(_PARSED_HTML_URL._replace(query=urlencode(query)))
+
+
+def build_web_app_url(user_id: int | None = None) -> str:
+    role = USER_ROLE_USER if user_id is None else get_user_role(user_id)
+    return _build_web_app_url_cached(user_id, role)
+
+
+@lru_cache(maxsize=4096)
+def _web_app_button_for_url(web_app_url: str, text: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text, web_app=WebAppInfo(url=web_app_url))
 
 
 def build_web_app_button(user_id: int | None = None, text: str = "📱 Открыть каталог") -> InlineKeyboardButton:
-    return InlineKeyboardButton(text, web_app=WebAppInfo(url=build_web_app_url(user_id)))
+    return _web_app_button_for_url(build_web_app_url(user_id), text)
+
+
+MAIN_MENU_STATIC_ROWS = (
+    (InlineKeyboardButton("👤 Мой профиль", callback_data='profile'),),
+    (InlineKeyboardButton("⭐ Рейтинг РА Эксперт", callback_data='rating'),),
+    (InlineKeyboardButton("📞 Контакты", callback_data='contacts'),),
+    (InlineKeyboardButton("ℹ️ О компании", callback_data='about'),),
+)
 
 
 def build_main_keyboard(user_id: int | None = None) -> list[list[InlineKeyboardButton]]:
-    return [
-        [build_web_app_button(user_id)],
-        [InlineKeyboardButton("👤 Мой профиль", callback_data='profile')],
-        [InlineKeyboardButton("⭐ Рейтинг РА Эксперт", callback_data='rating')],
-        [InlineKeyboardButton("📞 Контакты", callback_data='contacts')],
-        [InlineKeyboardButton("ℹ️ О компании", callback_data='about')]
-    ]
+    return [[build_web_app_button(user_id)], *(list(row) for row in MAIN_MENU_STATIC_ROWS)]
+
+
+@lru_cache(maxsize=4096)
+def _main_menu_markup_for_url(web_app_url: str) -> InlineKeyboardMarkup:
+    # Объекты PTB неизменяемы, поэтому одну разметку можно переиспользовать между сообщениями.
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("📱 Открыть каталог", web_app=WebAppInfo(url=web_app_url))],
+        *MAIN_MENU_STATIC_ROWS,
+    ])
 
 
 def build_main_menu_markup(user_id: int | None = None) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(build_main_keyboard(user_id))
+    # URL уже учитывает uid и роль, поэтому служит ключом кэша разметки.
+    return _main_menu_markup_for_url(build_web_app_url(user_id))
 
 
 def load_auth_users() -> dict:
     """Загружает пользователей, прошедших аутентификацию."""
-    if not AUTH_USERS_FILE.exists():
-        return {}
     try:
-        with open(AUTH_USERS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = read_json_file(AUTH_USERS_FILE)
         return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
     except Exception as e:
         logger.error("Ошибка чтения auth_users.json: %s", e)
         return {}
@@ -312,8 +642,7 @@ def load_auth_users() -> dict:
 
 def save_auth_users(users: dict) -> None:
     """Сохраняет пользователей, прошедших аутентификацию."""
-    with open(AUTH_USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+    write_json_file(AUTH_USERS_FILE, users)
 
 
 def build_preset_admin_auth_record(user_id: int) -> dict | None:
@@ -351,18 +680,36 @@ def get_authenticated_user(user_id: int) -> dict | None:
     return None
 
 
+# Статус аутентификации проверяется почти в каждом обработчике: кэшируем его на AUTH_CACHE_TTL секунд.
+AUTH_CACHE_TTL = 60.0
+_auth_cache: dict[int, tuple[bool, float]] = {}
+
+
+def invalidate_user_auth(user_id: int) -> None:
+    _auth_cache.pop(user_id, None)
+
+
 def is_user_authenticated(user_id: int) -> bool:
-    return get_authenticated_user(user_id) is not None
+    now = time.monotonic()
+    cached = _auth_cache.get(user_id)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+    authenticated = get_authenticated_user(user_id) is not None
+    _auth_cache[user_id] = (authenticated, now + AUTH_CACHE_TTL)
+    return authenticated
+
+
+AUTH_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton("🔐 Поделиться контактом", request_contact=True)]],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+    input_field_placeholder="Нажмите кнопку, чтобы пройти аутентификацию"
+)
 
 
 def build_auth_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для подтверждения личности через контакт Telegram."""
-    return ReplyKeyboardMarkup(
-        [[KeyboardButton("🔐 Поделиться контактом", request_contact=True)]],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-        input_field_placeholder="Нажмите кнопку, чтобы пройти аутентификацию"
-    )
+    return AUTH_KEYBOARD
 
 
 async def fetch_user_avatar_file_id(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> str | None:
@@ -405,6 +752,8 @@ async def register_authenticated_user(
     }
 
     save_auth_users(users)
+    invalidate_user_auth(user.id)
+    invalidate_user_role(user.id)
     sync_user_to_backend(users[str(user.id)])
     return users[str(user.id)]
 
@@ -412,10 +761,16 @@ async def register_authenticated_user(
 async def prompt_authentication(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
-    reason: str = ""
+    reason: str = "",
+    note: str = ""
 ) -> None:
-    """Просит пользователя пройти обязательную аутентификацию."""
+    """Просит пользователя пройти обязательную аутентификацию.
+
+    note дописывается в то же сообщение: один запрос к Telegram вместо отдельного reply_text.
+    """
     extra = f"\n\nПричина: {reason}" if reason else ""
+    if note:
+        extra += f"\n\n{note}"
     text = (
         "🔒 Для работы с ботом нужно пройти аутентификацию.\n"
         "Нажмите кнопку ниже и отправьте ваш контакт Telegram."
@@ -461,12 +816,7 @@ async def ensure_authenticated(
 
     await prompt_authentication(update, context, reason=reason)
     log_user_action(
-        {
-            "id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name
-        },
+        user_ctx(user),
         "auth_required",
         reason or "Попытка доступа без аутентификации"
     )
@@ -484,19 +834,23 @@ async def send_profile_card(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await prompt_authentication(update, context, reason="Просмотр профиля")
         return
 
-    # Актуализируем аватар при просмотре профиля.
-    avatar_file_id = auth_record.get("avatar_file_id") or await fetch_user_avatar_file_id(context, user.id)
-    if avatar_file_id and avatar_file_id != auth_record.get("avatar_file_id"):
-        users = load_auth_users()
-        if str(user.id) in users:
-            users[str(user.id)]["avatar_file_id"] = avatar_file_id
-            users[str(user.id)]["updated_at"] = datetime.now().isoformat()
-            save_auth_users(users)
+    # Аватар запрашиваем у Telegram и сохраняем, только если его ещё нет в записи.
+    avatar_file_id = auth_record.get("avatar_file_id")
+    if not avatar_file_id:
+        avatar_file_id = await fetch_user_avatar_file_id(context, user.id)
+        if avatar_file_id:
+            # load_auth_users отдаёт закэшированный словарь: файл заново не разбирается.
+            users = load_auth_users()
+            record = users.get(str(user.id))
+            if record is not None:
+                record["avatar_file_id"] = avatar_file_id
+                record["updated_at"] = datetime.now().isoformat()
+                save_auth_users(users)
 
     full_name = f"{auth_record.get('first_name', '')} {auth_record.get('last_name', '')}".strip() or "Не указано"
     username = f"@{auth_record.get('username')}" if auth_record.get("username") else "не указан"
     phone = auth_record.get("phone_number") or "не указан"
-    role_code = get_user_role(user.id)
+    role_code = await resolve_user_role(user.id)
     role_label = ROLE_LABELS.get(role_code, role_code)
     authenticated_at = auth_record.get("authenticated_at", "")
     if authenticated_at:
@@ -534,13 +888,23 @@ async def send_profile_card(update: Update, context: ContextTypes.DEFAULT_TYPE)
             reply_markup=build_main_menu_markup(user.id)
         )
 
+_NON_DIGITS_RE = re.compile(r"[^\d]")
+
+# Ключевые слова типа ТС из Excel -> категория фронтенда (проверяются по порядку).
+_VEHICLE_TYPE_CATEGORY_PATTERNS = (
+    ("passenger", "легков|lcv|седан|хэтчбек|внедорож"),
+    ("truck", "груз|тягач|фургон|самосвал|прицеп"),
+    ("spec", "экскават|бульдозер|трактор|каток|погрузчик|кран"),
+)
+
+
 def _parse_price_to_int(value) -> int:
     """Приводит цену к int."""
     if value is None:
         return 0
     if isinstance(value, (int, float)):
         return int(value)
-    text = re.sub(r"[^\d]", "", str(value))
+    text = _NON_DIGITS_RE.sub("", str(value))
     return int(text) if text else 0
 
 def _normalize_category(category: str) -> str:
@@ -558,75 +922,135 @@ def _normalize_category(category: str) -> str:
         return "equipment"
     return "equipment"
 
-def _category_from_vehicle_type(vehicle_type: str) -> str:
-    """Определяет категорию по полю типа ТС из Excel."""
-    text = (vehicle_type or "").lower()
-    if any(x in text for x in ["легков", "lcv", "седан", "хэтчбек", "внедорож"]):
-        return "passenger"
-    if any(x in text for x in ["груз", "тягач", "фургон", "самосвал", "прицеп"]):
-        return "truck"
-    if any(x in text for x in ["экскават", "бульдозер", "трактор", "каток", "погрузчик", "кран"]):
-        return "spec"
-    return "equipment"
+def _categories_from_vehicle_types(vehicle_types: pd.Series) -> np.ndarray:
+    """Определяет категории по столбцу типа ТС из Excel (векторно, без цикла по строкам)."""
+    text = vehicle_types.str.lower()
+    conditions = [text.str.contains(pattern, regex=True) for _, pattern in _VEHICLE_TYPE_CATEGORY_PATTERNS]
+    categories = [category for category, _ in _VEHICLE_TYPE_CATEGORY_PATTERNS]
+    return np.select(conditions, categories, default="equipment")
+
+
+def _digits_to_int(values: pd.Series) -> pd.Series:
+    """Векторный аналог _parse_price_to_int для строкового столбца: только цифры, пусто -> 0."""
+    digits = values.str.replace(_NON_DIGITS_RE, "", regex=True)
+    return pd.to_numeric(digits, errors="coerce").fillna(0).astype("int64")
+
+
+def _excel_cards_to_feed_items(cards: list[dict]) -> list[dict]:
+    """Преобразует карточки парсера в элементы фида одним проходом по столбцам DataFrame."""
+    if not cards:
+        return []
+    df = pd.DataFrame.from_records(cards)
+
+    def text_column(name: str) -> pd.Series:
+        if name not in df:
+            return pd.Series("", index=df.index, dtype=object)
+        return df[name].fillna("").astype(str)
+
+    title = text_column("title").str.strip()
+    keep = (title != "").to_numpy()
+    if not keep.any():
+        return []
+    df = df[keep]
+    title = title[keep]
+
+    code = text_column("code").str.strip()
+    # Номер без кода считается среди принятых карточек, как и раньше.
+    positions = pd.Series(np.arange(1, len(df) + 1), index=df.index).astype(str)
+    item_id = "excel-" + code.where(code != "", positions)
+
+    year = _digits_to_int(text_column("year"))
+    short_desc = text_column("short_desc")
+    details = short_desc.where(short_desc != "", text_column("comment")).str.slice(0, 2000)
+    location = text_column("location")
+    location = location.where(location != "", text_column("address"))
+    location = location.where(location != "", "Не указано")
+
+    items = pd.DataFrame(
+        {
+            "id": item_id,
+            "source_type": "excel",
+            "external_id": code,
+            "title": title,
+            "category": _categories_from_vehicle_types(text_column("vehicle_type")),
+            "price": _digits_to_int(text_column("price")),
+            "year": year.astype(object).where(year != 0, None),
+            "details": details,
+            "location": location,
+            "image": text_column("photo_url"),
+            "status": "active",
+            "createdAt": datetime.now().isoformat(),
+        }
+    )
+    return items.to_dict("records")
+
+# Служебный индекс фида id -> позиция в items; живёт только в памяти, в файл не пишется.
+FEED_INDEX_KEY = "_index"
+# id, которые встречаются в items больше одного раза (например, повтор кода в Excel).
+# Индекс хранит только первое вхождение, поэтому изменения таких id перестраивают его целиком.
+FEED_DUPLICATES_KEY = "_duplicates"
+_FEED_SERVICE_KEYS = (FEED_INDEX_KEY, FEED_DUPLICATES_KEY)
+
+
+def index_ads_feed(feed: dict) -> dict:
+    """Перестраивает индекс id -> позиция (при дублях id — первое вхождение)."""
+    index: dict[str, int] = {}
+    duplicates: set[str] = set()
+    for position, item in enumerate(feed["items"]):
+        item_id = str(item.get("id"))
+        if item_id in index:
+            duplicates.add(item_id)
+        else:
+            index[item_id] = position
+    feed[FEED_INDEX_KEY] = index
+    feed[FEED_DUPLICATES_KEY] = duplicates
+    return feed
+
 
 def load_ads_feed() -> dict:
     """Загружает единый фид объявлений."""
-    if not ADS_FEED_FILE.exists():
-        return {"updated_at": datetime.now().isoformat(), "items": []}
     try:
-        with open(ADS_FEED_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = read_json_file(ADS_FEED_FILE)
         if isinstance(data, list):
-            return {"updated_at": datetime.now().isoformat(), "items": data}
+            return index_ads_feed({"updated_at": datetime.now().isoformat(), "items": data})
         if "items" not in data:
             data["items"] = []
+        # Фид из кэша read_json_file уже проиндексирован — индекс строится один раз на версию файла.
+        if FEED_INDEX_KEY not in data:
+            index_ads_feed(data)
         return data
+    except FileNotFoundError:
+        return index_ads_feed({"updated_at": datetime.now().isoformat(), "items": []})
     except Exception as e:
         logger.error("Ошибка чтения ads_feed.json: %s", e)
-        return {"updated_at": datetime.now().isoformat(), "items": []}
+        return index_ads_feed({"updated_at": datetime.now().isoformat(), "items": []})
 
 def save_ads_feed(feed: dict) -> None:
     """Сохраняет единый фид объявлений."""
     feed["updated_at"] = datetime.now().isoformat()
-    with open(ADS_FEED_FILE, "w", encoding="utf-8") as f:
-        json.dump(feed, f, ensure_ascii=False, indent=2)
+    service = {key: feed.pop(key) for key in _FEED_SERVICE_KEYS if key in feed}
+    try:
+        write_json_file(ADS_FEED_FILE, feed)
+    finally:
+        feed.update(service)
 
-def replace_excel_ads(cards: list[dict]) -> int:
+def replace_excel_feed_items(excel_items: list[dict]) -> int:
     """Полностью заменяет Excel-часть общего фида на свежую выгрузку."""
     feed = load_ads_feed()
     manual_items = [item for item in feed.get("items", []) if item.get("source_type") != "excel"]
 
-    excel_items = []
-    for card in cards:
-        code = str(card.get("code", "")).strip()
-        title = str(card.get("title", "")).strip()
-        if not title:
-            continue
-        excel_items.append({
-            "id": f"excel-{code}" if code else f"excel-{len(excel_items) + 1}",
-            "source_type": "excel",
-            "external_id": code,
-            "title": title,
-            "category": _category_from_vehicle_type(card.get("vehicle_type", "")),
-            "price": _parse_price_to_int(card.get("price")),
-            "year": _parse_price_to_int(card.get("year")) or None,
-            "details": (card.get("short_desc") or card.get("comment") or "")[:2000],
-            "location": card.get("location") or card.get("address") or "Не указано",
-            "image": card.get("photo_url") or "",
-            "status": "active",
-            "createdAt": datetime.now().isoformat()
-        })
-
     feed["items"] = manual_items + excel_items
+    index_ads_feed(feed)
     save_ads_feed(feed)
     sync_ads_to_backend(excel_items)
     return len(excel_items)
 
-def add_manual_ad_to_feed(ad: dict, user_data: dict) -> dict:
+def add_manual_ad_to_feed(ad: dict, user_data: UserCtx) -> dict:
     """Добавляет ручное объявление в общий фид."""
     feed = load_ads_feed()
 
-    ad_id = str(ad.get("id") or f"manual-{int(datetime.now().timestamp())}-{user_data.get('id')}")
+    ad_id = str(ad.get("id") or f"manual-{int(datetime.now().timestamp())}-{user_data.id}")
+    images = ad.get("images")
     feed_item = {
         "id": ad_id,
         "source_type": "manual",
@@ -637,32 +1061,35 @@ def add_manual_ad_to_feed(ad: dict, user_data: dict) -> dict:
         "year": _parse_price_to_int(ad.get("year")) or None,
         "details": str(ad.get("details", "")).strip()[:2000],
         "location": str(ad.get("location", "Не указано")).strip() or "Не указано",
-        "image": (ad.get("images") or [""])[0] if isinstance(ad.get("images"), list) else "",
+        "image": (images or [""])[0] if isinstance(images, list) else "",
         "status": "active",
         "createdAt": ad.get("createdAt") or datetime.now().isoformat(),
-        "author": {
-            "id": user_data.get("id"),
-            "username": user_data.get("username"),
-            "first_name": user_data.get("first_name"),
-            "last_name": user_data.get("last_name")
-        }
+        "author": user_data._asdict()
     }
 
-    items = [item for item in feed.get("items", []) if str(item.get("id")) != ad_id]
-    items.append(feed_item)
-    feed["items"] = items
+    items = feed["items"]
+    index = feed[FEED_INDEX_KEY]
+    position = index.get(ad_id)
+    if ad_id in feed[FEED_DUPLICATES_KEY]:
+        # Все старые копии id заменяются одной новой записью
+        feed["items"] = [item for item in items if str(item.get("id")) != ad_id]
+        feed["items"].append(feed_item)
+        index_ads_feed(feed)
+    elif position is None:
+        index[ad_id] = len(items)
+        items.append(feed_item)
+    else:
+        items[position] = feed_item
     save_ads_feed(feed)
     sync_ad_to_backend(feed_item)
     return feed_item
 
 
 def _find_feed_item_by_id(feed: dict, ad_id: str) -> tuple[int, dict] | tuple[None, None]:
-    ad_id_str = str(ad_id)
-    items = feed.get("items", [])
-    for index, item in enumerate(items):
-        if str(item.get("id")) == ad_id_str:
-            return index, item
-    return None, None
+    index = feed[FEED_INDEX_KEY].get(str(ad_id))
+    if index is None:
+        return None, None
+    return index, feed["items"][index]
 
 
 def _can_user_edit_or_delete_ad(actor_user_id: int, actor_role: str, ad_item: dict) -> tuple[bool, str]:
@@ -688,7 +1115,7 @@ def _can_user_edit_or_delete_ad(actor_user_id: int, actor_role: str, ad_item: di
 def update_manual_ad_in_feed(
     ad_id: str,
     ad_updates: dict,
-    actor_user_data: dict,
+    actor_user_data: UserCtx,
     actor_role: str
 ) -> tuple[dict | None, str]:
     feed = load_ads_feed()
@@ -696,7 +1123,7 @@ def update_manual_ad_in_feed(
     if target is None:
         return None, "Объявление не найдено."
 
-    allowed, reason = _can_user_edit_or_delete_ad(int(actor_user_data.get("id")), actor_role, target)
+    allowed, reason = _can_user_edit_or_delete_ad(actor_user_data.id, actor_role, target)
     if not allowed:
         return None, reason
 
@@ -742,7 +1169,7 @@ def update_manual_ad_in_feed(
     save_ads_feed(feed)
     sync_update_ad_with_permissions(
         str(ad_id),
-        int(actor_user_data.get("id")),
+        actor_user_data.id,
         actor_role,
         updates
     )
@@ -751,7 +1178,7 @@ def update_manual_ad_in_feed(
 
 def delete_manual_ad_from_feed(
     ad_id: str,
-    actor_user_data: dict,
+    actor_user_data: UserCtx,
     actor_role: str
 ) -> tuple[bool, str]:
     feed = load_ads_feed()
@@ -759,17 +1186,35 @@ def delete_manual_ad_from_feed(
     if target is None or index is None:
         return False, "Объявление не найдено."
 
-    allowed, reason = _can_user_edit_or_delete_ad(int(actor_user_data.get("id")), actor_role, target)
+    allowed, reason = _can_user_edit_or_delete_ad(actor_user_data.id, actor_role, target)
     if not allowed:
         return False, reason
 
-    items = feed.get("items", [])
-    del items[index]
-    feed["items"] = items
+    items = feed["items"]
+    feed_index = feed[FEED_INDEX_KEY]
+    if str(ad_id) in feed[FEED_DUPLICATES_KEY]:
+        # Остальные копии id должны остаться в индексе — перестраиваем его
+        del items[index]
+        index_ads_feed(feed)
+    else:
+        # Удаление за O(1): на место удаляемого ставится последний элемент (порядок фида не важен,
+        # фронтенд сортирует объявления сам).
+        last = items.pop()
+        del feed_index[str(ad_id)]
+        if index < len(items):
+            items[index] = last
+            last_id = str(last.get("id"))
+            # У дублирующегося id индекс указывает на более раннюю копию — её и оставляем
+            if feed_index.get(last_id) == len(items):
+                feed_index[last_id] = index
     save_ads_feed(feed)
-    sync_delete_ad_with_permissions(str(ad_id), int(actor_user_data.get("id")), actor_role)
+    sync_delete_ad_with_permissions(str(ad_id), actor_user_data.id, actor_role)
     return True, ""
 
+_HTML_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+_HTML_SPECIAL_RE = re.compile(r'[&<>"]')
+
+
 def escape_html_for_telegram(text: str) -> str:
     """
     Экранирование текста для безопасного использования в Telegram с parse_mode='HTML'
@@ -786,19 +1231,19 @@ def escape_html_for_telegram(text: str) -> str:
     
     # Экранируем только основные HTML-символы, которые могут сломать парсинг
     # В Telegram HTML mode разрешены только <, >, &, "
-    escaped = text
-    
-    # Заменяем & на &amp; ПЕРВЫМ, чтобы не ломать другие замены
-    escaped = escaped.replace('&', '&amp;')
-    
-    # Затем заменяем остальные символы
-    escaped = escaped.replace('<', '&lt;')
-    escaped = escaped.replace('>', '&gt;')
-    escaped = escaped.replace('"', '&quot;')
-    
-    return escaped
+    # Обычно спецсимволов нет: быстрый поиск на C и возврат исходной строки без копии
+    if _HTML_SPECIAL_RE.search(text) is None:
+        return text
+    # Одна таблица translate: строка проходится один раз, & не экранируется повторно
+    return text.translate(_HTML_ESCAPE_TABLE)
 
-def log_user_action(user_data: dict, action: str, details: str = "") -> None:
+
+@lru_cache(maxsize=16384)
+def escape_user_name(name: str | None, default: str = "") -> str:
+    """Экранированное имя пользователя; имена повторяются от апдейта к апдейту, поэтому кэшируем."""
+    return escape_html_for_telegram(name) if name else default
+
+def log_user_action(user_data: UserCtx, action: str, details: str = "") -> None:
     """
     Логирование действий пользователя
     
@@ -811,117 +1256,146 @@ def log_user_action(user_data: dict, action: str, details: str = "") -> None:
         # Формируем запись лога
         log_entry = {
             "timestamp": datetime.now().isoformat(),
-            "user_id": user_data.get("id"),
-            "username": user_data.get("username"),
-            "first_name": user_data.get("first_name"),
-            "last_name": user_data.get("last_name"),
+            "user_id": user_data.id,
+            "username": user_data.username,
+            "first_name": user_data.first_name,
+            "last_name": user_data.last_name,
             "action": action,
             "details": details
         }
         
-        # Загружаем существующие логи
-        logs = []
-        if os.path.exists(USERS_LOG_FILE):
-            try:
-                with open(USERS_LOG_FILE, 'r', encoding='utf-8') as f:
-                    logs = json.load(f)
-            except (json.JSONDecodeError, IOError):
-                logs = []
-        
-        # Добавляем новую запись
-        logs.append(log_entry)
-        
-        # Сохраняем (ограничиваем размер файла - последние 1000 записей)
-        if len(logs) > 1000:
-            logs = logs[-1000:]
-        
-        with open(USERS_LOG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
+        # Запись уходит в буфер; на диск её допишет _users_log_flush_loop
+        with _users_log_lock:
+            _users_log_buffer.append(json_dumps(log_entry) + b"\n")
+            batch_ready = len(_users_log_buffer) >= USERS_LOG_BATCH_SIZE
+        if batch_ready or _users_log_flush_task is None:
+            # Без фоновой задачи (вне run_polling) пишем сразу, как раньше.
+            flush_users_log()
         
         # Также логируем в консоль
-        logger.info(f"User action: {user_data.get('username')} ({user_data.get('id')}) - {action} - {details}")
+        logger.info(f"User action: {user_data.username} ({user_data.id}) - {action} - {details}")
         sync_user_action_to_backend(log_entry)
     
     except Exception as e:
         logger.error(f"Error logging user action: {e}")
 
+def _trim_users_log() -> None:
+    """Оставляет в логе последние USERS_LOG_MAX_ENTRIES записей (атомарная перезапись)."""
+    with open(USERS_LOG_FILE, 'rb') as f:
+        tail = deque(f, maxlen=USERS_LOG_MAX_ENTRIES)
+    atomic_write_bytes(USERS_LOG_FILE, b"".join(tail))
+
+
+def _maybe_trim_users_log(written: int) -> None:
+    # Обрезка раз в USERS_LOG_TRIM_EVERY записей: между обрезками файл может немного превышать лимит.
+    global _users_log_writes
+    _users_log_writes += written
+    if _users_log_writes >= USERS_LOG_TRIM_EVERY:
+        _users_log_writes = 0
+        _trim_users_log()
+
+
+def flush_users_log() -> None:
+    """Дописывает накопленные записи в users_log.jsonl одной операцией."""
+    # Запись идёт под блокировкой: сброс из потока и из обработчика не перемешают строки.
+    with _users_log_lock:
+        if not _users_log_buffer:
+            return
+        lines = b"".join(_users_log_buffer)
+        written = len(_users_log_buffer)
+        _users_log_buffer.clear()
+        try:
+            with open(USERS_LOG_FILE, 'ab') as f:
+                f.write(lines)
+            _maybe_trim_users_log(written)
+        except OSError as e:
+            logger.error(f"Error writing users log: {e}")
+
+
+async def _users_log_flush_loop() -> None:
+    while True:
+        await asyncio.sleep(USERS_LOG_FLUSH_INTERVAL)
+        await asyncio.to_thread(flush_users_log)
+
+
+def start_users_log_flusher() -> None:
+    global _users_log_flush_task
+    # Как и воркер backend: Application.stop() не должен ждать бесконечную задачу.
+    _users_log_flush_task = asyncio.get_running_loop().create_task(_users_log_flush_loop())
+
+
+def stop_users_log_flusher() -> None:
+    global _users_log_flush_task
+    if _users_log_flush_task is None:
+        return
+    _users_log_flush_task.cancel()
+    _users_log_flush_task = None
+    flush_users_log()
+
+
+def migrate_legacy_users_log() -> None:
+    """Переводит старый users_log.json (JSON-массив) в формат JSON Lines."""
+    if os.path.exists(USERS_LOG_FILE) or not os.path.exists(LEGACY_USERS_LOG_FILE):
+        return
+    try:
+        logs = json_loads(Path(LEGACY_USERS_LOG_FILE).read_bytes())
+    except (json.JSONDecodeError, IOError) as e:
+        logger.error(f"Не удалось перенести {LEGACY_USERS_LOG_FILE}: {e}")
+        return
+    if not isinstance(logs, list):
+        return
+    lines = b"".join(json_dumps(entry) + b"\n" for entry in logs[-USERS_LOG_MAX_ENTRIES:])
+    atomic_write_bytes(USERS_LOG_FILE, lines)
+    logger.info(f"Лог пользователей перенесён из {LEGACY_USERS_LOG_FILE} в {USERS_LOG_FILE}")
+
+
+# Статистика пересчитывается, только если файл лога изменился: (отметка файла, результат).
+_USER_STATS_CACHE: list = [None, None]
+
+
 def get_user_stats() -> dict:
     """Получение статистики пользователей"""
+    # Статистика должна учитывать и записи, ещё не сброшенные из буфера.
+    flush_users_log()
     if not os.path.exists(USERS_LOG_FILE):
         return {"total_users": 0, "total_actions": 0, "unique_users": 0}
     
     try:
-        with open(USERS_LOG_FILE, 'r', encoding='utf-8') as f:
-            logs = json.load(f)
-        
-        # Собираем уникальных пользователей
+        stamp = _file_stamp(USERS_LOG_FILE)
+        if _USER_STATS_CACHE[0] == stamp:
+            return _USER_STATS_CACHE[1]
+        # Потоковый разбор: файл не загружается в память целиком
+        total = 0
         unique_users = set()
-        for log in logs:
-            unique_users.add(log.get("user_id"))
+        actions_count = defaultdict(int)
+        with open(USERS_LOG_FILE, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                log = json_loads(line)
+                total += 1
+                unique_users.add(log.get("user_id"))
+                actions_count[log.get("action")] += 1
         
-        # Статистика по действиям
-        actions_count = {}
-        for log in logs:
-            action = log.get("action")
-            actions_count[action] = actions_count.get(action, 0) + 1
-        
-        return {
-            "total_users": len(logs),
-            "total_actions": sum(actions_count.values()),
+        stats = {
+            "total_users": total,
+            "total_actions": total,
             "unique_users": len(unique_users),
-            "actions_count": actions_count
+            "actions_count": dict(actions_count)
         }
+        _USER_STATS_CACHE[0] = stamp
+        _USER_STATS_CACHE[1] = stats
+        return stats
     
     except Exception as e:
         logger.error(f"Error getting user stats: {e}")
         return {"error": str(e)}
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик команды /start (доступна всем)"""
-    user = update.effective_user
-    
-    # ОТЛАДОЧНАЯ ИНФОРМАЦИЯ
-    logger.info(f"Пользователь пытается запустить бота:")
-    logger.info(f"ID: {user.id}")
-    logger.info(f"Имя: {user.first_name}")
-    logger.info(f"Username: @{user.username}")
-    logger.info(f"В списке админов: {user.id in ADMIN_IDS}")
-    logger.info(f"Полный список админов: {ADMIN_IDS}")
-    # КОНЕЦ ОТЛАДОЧНОЙ ИНФОРМАЦИИ
-    
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name,
-        "language_code": user.language_code
-    }
-    
-    # Логируем начало работы пользователя
-    log_user_action(user_data, "start", "Пользователь запустил бота")
+RATING_URL = "https://raexpert.ru/rankingtable/leasing/9m2022/main/"
 
-    # Обязательная аутентификация перед использованием бота.
-    if not is_user_authenticated(user.id):
-        await prompt_authentication(update, context, reason="Первый запуск /start")
-        await update.message.reply_text(
-            "После подтверждения контакта доступны каталог, заявки и профиль.",
-            reply_markup=build_auth_keyboard()
-        )
-        return
-    
-    # Экранируем имя пользователя для безопасного использования в HTML
-    # НОВЫЙ ПОДХОД: используем более мягкое экранирование
-    if user.first_name:
-        # Экранируем только опасные символы
-        safe_first_name = escape_html_for_telegram(user.first_name)
-        # Для отладки выведем, что получилось
-        logger.info(f"Исходное имя: {user.first_name}")
-        logger.info(f"Экранированное имя: {safe_first_name}")
-    else:
-        safe_first_name = "Пользователь"
-    
-    welcome_text = f"""
-👋 Здравствуйте, {safe_first_name}!
+# Тексты статичных экранов собираются один раз при импорте; в приветствие подставляется только имя.
+WELCOME_TEMPLATE = """
+👋 Здравствуйте, {name}!
 
 Я бот компании <b>КФЛ Лизинг</b> — вашего надежного партнера в сфере лизинга конфиската.
 
@@ -938,33 +1412,271 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 📱 <b>Каталог открывается прямо в Telegram!</b>
 """
-    
-    reply_markup = build_main_menu_markup(user.id)
-    await update.message.reply_text(
-        welcome_text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
 
+HELP_TEXT = """
+<b>📚 Справка по командам</b>
 
-async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Запрашивает обязательную аутентификацию через контакт Telegram."""
-    user = update.effective_user
-    if user and is_user_authenticated(user.id):
-        await update.message.reply_text(
-            "✅ Вы уже аутентифицированы. Используйте /profile для просмотра профиля.",
-            reply_markup=build_main_menu_markup(user.id)
-        )
-        return
-
-    await prompt_authentication(update, context, reason="Команда /login")
+<b>Основные команды:</b>
+/start - Запустить бота и показать меню
+/catalogue - Открыть каталог конфиската (в Telegram)
+/login - Пройти аутентификацию
+/profile - Показать мой профиль
+/help - Показать эту справку
+/stats - Статистика (только админ)
 
+<b>Импорт Excel:</b>
+• Запускается только через WebApp (кнопка «Парсер»)
+• Доступен ролям «Администратор» и «Лизинговая компания»
 
-async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Команда просмотра профиля аутентифицированного пользователя."""
-    if not await ensure_authenticated(update, context, reason="Команда /profile"):
-        return
-    await send_profile_card(update, context)
+<b>Быстрые действия через кнопки:</b>
+📱 <b>Открыть каталог</b> - Каталог откроется прямо в Telegram
+⭐ <b>Рейтинг РА Эксперт</b> - Узнать о наших достижениях  
+📞 <b>Контакты</b> - Связаться с нами
+ℹ️ <b>О компании</b> - Подробнее о КФЛ Лизинг
+
+<b>💡 Советы по использованию Web App:</b>
+• Каталог открывается внутри Telegram (не нужно переходить в браузер)
+• Полностью адаптирован для мобильных устройств
+• Для быстрого доступа можно закрепить сообщение с каталогом
+"""
+
+CATALOGUE_TEXT = """
+<b>📋 Каталог конфиската КФЛ Лизинг</b>
+
+Нажмите кнопку ниже, чтобы открыть интерактивный каталог прямо в Telegram:
+
+<b>📊 В каталоге представлено:</b>
+• 🚜 <b>24 единицы</b> спецтехники
+• 🚛 <b>15 единиц</b> грузового транспорта  
+• 🚗 <b>8 единиц</b> легковых автомобилей
+• ⚙️ <b>13 единиц</b> оборудования
+
+<b>✨ Особенности Web App каталога:</b>
+• 📱 Оптимизирован для просмотра в Telegram
+• 🔍 Умный поиск по характеристикам
+• ⚡ Быстрая фильтрация
+• 💖 Добавление в избранное
+• 📝 Мгновенные заявки на лизинг
+"""
+
+RATING_TEXT = """
+<b>⭐ Рейтинг РА Эксперт 2022</b>
+
+Мы гордимся, что <b>КФЛ Лизинг занимает 30 место</b> в рейтинге РА Эксперт по объему нового бизнеса в лизинге за 9 месяцев 2022 года.
+
+<b>🏆 Наши достижения:</b>
+• 📈 Более 10 лет стабильной работы на рынке
+• ✅ 60+ актуальных предложений в каталоге
+• 🏗️ 4 основные категории техники
+• 💼 Индивидуальные условия лизинга для каждого клиента
+
+<b>🔗 Ссылка на рейтинг:</b>
+https://raexpert.ru/rankingtable/leasing/9m2022/main/
+"""
+
+CONTACTS_TEXT = """
+<b>📞 Контакты КФЛ Лизинг</b>
+
+<b>📍 Адрес:</b>
+г. Новокузнецк
+
+<b>☎️ Телефон:</b>
++7 (XXX) XXX-XX-XX
+
+<b>📧 Email:</b>
+info@kuzfl.ru
+
+<b>🕒 Часы работы:</b>
+Пн-Пт: 9:00 - 18:00
+Сб: 10:00 - 16:00  
+Вс: выходной
+
+<b>👨‍💼 Для связи с менеджером:</b>
+Просто отправьте сообщение в этот чат, и мы перезвоним вам в рабочее время.
+"""
+
+ABOUT_TEXT = """
+<b>🏢 О компании КФЛ Лизинг</b>
+
+<b>🎯 Наша миссия:</b>
+Предоставлять клиентам доступ к качественной технике и оборудованию через удобные и прозрачные условия лизинга конфиската.
+
+<b>📊 Что мы предлагаем:</b>
+• Лизинг конфиската — техники и оборудования, изъятого у должников
+• Юридическую проверку всех лотов
+• Полное сопровождение сделки
+• Индивидуальный подход к каждому клиенту
+• Конкурентные ставки по лизингу
+
+<b>✅ Наши гарантии:</b>
+• Все предложения проверены юридически
+• Подробные технические характеристики
+• Честные цены без скрытых комиссий
+• Профессиональная консультация
+"""
+
+MANAGER_TEXT = """
+<b>👨‍💼 Связь с менеджером</b>
+
+Для связи с персональным менеджером и консультации по вопросам лизинга:
+
+<b>☎️ Позвоните:</b>
++7 (XXX) XXX-XX-XX
+
+<b>📧 Напишите:</b>
+info@kuzfl.ru
+
+<b>💬 Или оставьте заявку здесь:</b>
+Просто отправьте сообщение с вашими контактными данными, и наш менеджер свяжется с вами в течение 30 минут в рабочее время.
+
+<b>🕒 Работаем:</b>
+Понедельник - Пятница: 9:00 - 18:00
+"""
+
+REQUEST_TEXT = """
+<b>📝 Заявка на консультацию</b>
+
+Для оформления заявки на лизинг или получения консультации:
+
+<b>1️⃣ Позвоните нам:</b>
++7 (XXX) XXX-XX-XX
+
+<b>2️⃣ Напишите на email:</b>
+info@kuzfl.ru
+
+<b>3️⃣ Или оставьте заявку здесь:</b>
+Отправьте сообщение с указанием:
+• Вашего имени
+• Контактного телефона  
+• Интересуемой техники (если есть)
+
+<b>⏱️ Мы перезвоним вам в течение 30 минут!</b>
+"""
+
+BACK_BUTTON_ROW = (InlineKeyboardButton("◀️ Назад", callback_data='menu'),)
+BACK_TO_MENU_BUTTON_ROW = (InlineKeyboardButton("◀️ Назад в меню", callback_data='menu'),)
+
+# Экран: (текст, ряды до кнопки каталога, подпись кнопки каталога, ряды после неё).
+INFO_PAGES = {
+    'rating': (
+        RATING_TEXT,
+        ((InlineKeyboardButton("🌐 Открыть рейтинг", url=RATING_URL),),),
+        "📱 Открыть каталог",
+        (BACK_BUTTON_ROW,),
+    ),
+    'contacts': (
+        CONTACTS_TEXT,
+        (),
+        "📱 Открыть каталог",
+        ((InlineKeyboardButton("📝 Оставить заявку", callback_data='request'),), BACK_BUTTON_ROW),
+    ),
+    'about': (
+        ABOUT_TEXT,
+        (),
+        "📱 Открыть каталог",
+        ((InlineKeyboardButton("⭐ Наш рейтинг", callback_data='rating'),), BACK_BUTTON_ROW),
+    ),
+    'manager': (
+        MANAGER_TEXT,
+        (),
+        "📱 Открыть каталог",
+        (BACK_TO_MENU_BUTTON_ROW,),
+    ),
+    'request': (
+        REQUEST_TEXT,
+        (),
+        "📱 Открыть каталог",
+        ((InlineKeyboardButton("📞 Контакты", callback_data='contacts'),), BACK_BUTTON_ROW),
+    ),
+}
+
+# /catalogue — не callback-экран, но его разметка собирается так же.
+CATALOGUE_PAGE = (
+    CATALOGUE_TEXT,
+    (),
+    "🚀 Открыть каталог (в Telegram)",
+    ((InlineKeyboardButton("📞 Связаться с менеджером", callback_data='manager'),), BACK_TO_MENU_BUTTON_ROW),
+)
+
+
+@lru_cache(maxsize=4096)
+def _info_page_markup(page: str, web_app_url: str) -> InlineKeyboardMarkup:
+    _, rows_before, web_app_text, rows_after = CATALOGUE_PAGE if page == 'catalogue' else INFO_PAGES[page]
+    return InlineKeyboardMarkup([
+        *rows_before,
+        [InlineKeyboardButton(web_app_text, web_app=WebAppInfo(url=web_app_url))],
+        *rows_after,
+    ])
+
+
+def build_info_page_markup(page: str, user_id: int | None = None) -> InlineKeyboardMarkup:
+    return _info_page_markup(page, build_web_app_url(user_id))
+
+
+# callback_data -> (текст, построитель разметки по user_id): нажатие кнопки — один поиск в словаре.
+CALLBACK_SCREENS = {
+    **{page: (screen[0], partial(build_info_page_markup, page)) for page, screen in INFO_PAGES.items()},
+    'menu': ("Главное меню:", build_main_menu_markup),
+}
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /start (доступна всем)"""
+    user = update.effective_user
+    
+    # Отладочная информация — только при уровне DEBUG (в ней персональные данные)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Пользователь пытается запустить бота: id=%s, имя=%s, username=@%s, в списке админов: %s",
+            user.id, user.first_name, user.username, user.id in ADMIN_IDS
+        )
+    
+    user_data = user_ctx(user)
+    
+    # Логируем начало работы пользователя
+    log_user_action(user_data, "start", "Пользователь запустил бота")
+
+    # Обязательная аутентификация перед использованием бота.
+    if not is_user_authenticated(user.id):
+        await prompt_authentication(
+            update,
+            context,
+            reason="Первый запуск /start",
+            note="После подтверждения контакта доступны каталог, заявки и профиль."
+        )
+        return
+    
+    # Экранируем имя пользователя для безопасного использования в HTML
+    safe_first_name = escape_user_name(user.first_name, "Пользователь")
+    
+    welcome_text = WELCOME_TEMPLATE.replace("{name}", safe_first_name)
+    
+    reply_markup = build_main_menu_markup(user.id)
+    await update.message.reply_text(
+        welcome_text,
+        parse_mode='HTML',
+        reply_markup=reply_markup
+    )
+
+
+async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Запрашивает обязательную аутентификацию через контакт Telegram."""
+    user = update.effective_user
+    if user and is_user_authenticated(user.id):
+        await update.message.reply_text(
+            "✅ Вы уже аутентифицированы. Используйте /profile для просмотра профиля.",
+            reply_markup=build_main_menu_markup(user.id)
+        )
+        return
+
+    await prompt_authentication(update, context, reason="Команда /login")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда просмотра профиля аутентифицированного пользователя."""
+    if not await ensure_authenticated(update, context, reason="Команда /profile"):
+        return
+    await send_profile_card(update, context)
 
 
 async def contact_auth_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -988,15 +1700,10 @@ async def contact_auth_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
     record = await register_authenticated_user(user, contact.phone_number, context)
 
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
     log_user_action(user_data, "auth_success", f"Аутентификация по контакту: {record.get('phone_number')}")
 
-    safe_first_name = escape_html_for_telegram(user.first_name) if user.first_name else "Пользователь"
+    safe_first_name = escape_user_name(user.first_name, "Пользователь")
     await update.message.reply_text(
         f"✅ {safe_first_name}, аутентификация прошла успешно!",
         reply_markup=ReplyKeyboardRemove()
@@ -1010,12 +1717,7 @@ async def contact_auth_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 async def catalogue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /catalogue (доступна всем)"""
     user = update.effective_user
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not await ensure_authenticated(update, context, reason="Открытие каталога"):
         return
@@ -1023,34 +1725,9 @@ async def catalogue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Логируем открытие каталога
     log_user_action(user_data, "catalogue", "Пользователь открыл каталог")
     
-    message_text = """
-<b>📋 Каталог конфиската КФЛ Лизинг</b>
-
-Нажмите кнопку ниже, чтобы открыть интерактивный каталог прямо в Telegram:
-
-<b>📊 В каталоге представлено:</b>
-• 🚜 <b>24 единицы</b> спецтехники
-• 🚛 <b>15 единиц</b> грузового транспорта  
-• 🚗 <b>8 единиц</b> легковых автомобилей
-• ⚙️ <b>13 единиц</b> оборудования
-
-<b>✨ Особенности Web App каталога:</b>
-• 📱 Оптимизирован для просмотра в Telegram
-• 🔍 Умный поиск по характеристикам
-• ⚡ Быстрая фильтрация
-• 💖 Добавление в избранное
-• 📝 Мгновенные заявки на лизинг
-"""
-    
-    keyboard = [
-        [build_web_app_button(user.id, "🚀 Открыть каталог (в Telegram)")],
-        [InlineKeyboardButton("📞 Связаться с менеджером", callback_data='manager')],
-        [InlineKeyboardButton("◀️ Назад в меню", callback_data='menu')]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = build_info_page_markup('catalogue', user.id)
     await update.message.reply_text(
-        message_text,
+        CATALOGUE_TEXT,
         parse_mode='HTML',
         reply_markup=reply_markup,
         disable_web_page_preview=True
@@ -1059,12 +1736,7 @@ async def catalogue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /help (доступна всем)"""
     user = update.effective_user
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not is_user_authenticated(user.id):
         await update.message.reply_text(
@@ -1076,36 +1748,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Логируем запрос справку
     log_user_action(user_data, "help", "Пользователь запросил справку")
     
-    help_text = """
-<b>📚 Справка по командам</b>
-
-<b>Основные команды:</b>
-/start - Запустить бота и показать меню
-/catalogue - Открыть каталог конфиската (в Telegram)
-/login - Пройти аутентификацию
-/profile - Показать мой профиль
-/help - Показать эту справку
-/stats - Статистика (только админ)
-
-<b>Импорт Excel:</b>
-• Запускается только через WebApp (кнопка «Парсер»)
-• Доступен ролям «Администратор» и «Лизинговая компания»
-
-<b>Быстрые действия через кнопки:</b>
-📱 <b>Открыть каталог</b> - Каталог откроется прямо в Telegram
-⭐ <b>Рейтинг РА Эксперт</b> - Узнать о наших достижениях  
-📞 <b>Контакты</b> - Связаться с нами
-ℹ️ <b>О компании</b> - Подробнее о КФЛ Лизинг
-
-<b>💡 Советы по использованию Web App:</b>
-• Каталог открывается внутри Telegram (не нужно переходить в браузер)
-• Полностью адаптирован для мобильных устройств
-• Для быстрого доступа можно закрепить сообщение с каталогом
-"""
     
     reply_markup = build_main_menu_markup(user.id)
     await update.message.reply_text(
-        help_text,
+        HELP_TEXT,
         parse_mode='HTML',
         reply_markup=reply_markup
     )
@@ -1113,22 +1759,16 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /stats (только для администраторов)"""
     user = update.effective_user
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not await ensure_authenticated(update, context, reason="Просмотр статистики"):
         return
     
-    # ОТЛАДОЧНАЯ ИНФОРМАЦИЯ
-    logger.info(f"Пользователь пытается получить статистику:")
-    logger.info(f"ID: {user.id}")
-    logger.info(f"Username: @{user.username}")
-    logger.info(f"В списке админов: {user.id in ADMIN_IDS}")
-    # КОНЕЦ ОТЛАДОЧНОЙ ИНФОРМАЦИИ
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Пользователь пытается получить статистику: id=%s, username=@%s, в списке админов: %s",
+            user.id, user.username, user.id in ADMIN_IDS
+        )
     
     # Проверяем, является ли пользователь администратором
     # ТОЛЬКО для этой команды!
@@ -1162,7 +1802,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             for action, count in sorted(actions_count.items()):
                 stats_text += f"\n• {action}: {count}"
         
-        stats_text += f"\n\n⏱️ <b>Последнее обновление:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        stats_text += f"\n\n⏱️ <b>Последнее обновление:</b> {format_now('%Y-%m-%d %H:%M:%S')}"
     
     await update.message.reply_text(
         stats_text,
@@ -1172,17 +1812,12 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def parse_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Запуск режима парсинга Excel (администратор и лизинговая компания)."""
     user = update.effective_user
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not await ensure_authenticated(update, context, reason="Запуск парсера"):
         return
 
-    if not can_user_manage_ads(user.id):
+    if not await can_user_manage_ads(user.id):
         await update.message.reply_text(
             "⛔ Импорт Excel доступен только ролям «Администратор» и «Лизинговая компания»."
         )
@@ -1206,23 +1841,82 @@ async def parse_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         parse_mode="Markdown"
     )
 
+def _run_parser_sync(input_path: Path, output_dir: Path) -> tuple[pd.DataFrame, list[dict], list[dict], str, str]:
+    """Блокирующая часть импорта Excel: чтение, маппинг, карточки, сайт и предпросмотр."""
+    # Книга открывается один раз и переиспользуется для листов, заголовков и данных.
+    with pd.ExcelFile(input_path) as excel_file:
+        sheets = excel_file.sheet_names
+        if "зимние скидки" in sheets:
+            sheet_name = "зимние скидки"
+            header = 0
+        else:
+            sheet_name = sheets[0] if sheets else "Sheet1"
+            header = 2
+
+        df_headers = excel_file.parse(
+            sheet_name=sheet_name,
+            header=header,
+            nrows=0
+        )
+        excel_columns = list(df_headers.columns)
+
+        mapping = config_manager.get_mapping_template(input_path.stem)
+        mapping_source = "template"
+
+        if not mapping:
+            mapping_source = "auto"
+            config = config_manager.load_config()
+            target_fields = list(config.get("fuzzy_keywords", {}).keys())
+            auto_result = column_mapper.auto_map_columns(
+                excel_columns,
+                target_fields,
+                config.get("fuzzy_keywords", {})
+            )
+            mapping = auto_result.get("mapping", {})
+            is_valid, missing_critical = column_mapper.validate_mapping(mapping)
+            if not is_valid:
+                missing_str = ", ".join(missing_critical)
+                raise ValueError(f"Не удалось сопоставить обязательные столбцы: {missing_str}")
+
+        df = read_flexible(
+            excel_file,
+            mapping=mapping,
+            sheet_name=sheet_name,
+            header=header
+        )
+    cards = prepare_cards(df)
+    generate_site(cards, output_dir)
+    excel_items = _excel_cards_to_feed_items(cards)
+
+    preview_df = df.head(8).fillna("")
+    preview_text = preview_df.to_string(index=False)
+    if len(preview_text) > 3500:
+        preview_text = preview_text[:3500] + "\n..."
+    return df, cards, excel_items, mapping_source, preview_text
+
 async def parse_document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка загруженного Excel-файла и запуск парсера."""
     if not update.message or not update.message.document:
         return
 
+    # Сначала дешёвые проверки по метаданным документа — до auth-кэша и роли.
+    document = update.message.document
+    filename = document.file_name or "upload.xlsx"
+    ext = Path(filename).suffix.lower()
+    if ext not in EXCEL_EXTENSIONS:
+        await update.message.reply_text("Нужен Excel-файл с расширением `.xlsx`, `.xls` или `.xlsm`.")
+        return
+    if document.file_size and document.file_size > MAX_EXCEL_BYTES:
+        await update.message.reply_text("⛔ Файл слишком большой: бот может скачивать файлы до 20 МБ.")
+        return
+
     user = update.effective_user
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not await ensure_authenticated(update, context, reason="Загрузка файла для парсинга"):
         return
 
-    if not can_user_manage_ads(user.id):
+    if not await can_user_manage_ads(user.id):
         await update.message.reply_text(
             "⛔ Загрузка файлов для парсинга доступна только ролям «Администратор» и «Лизинговая компания»."
         )
@@ -1243,14 +1937,7 @@ async def parse_document_handler(update: Update, context: ContextTypes.DEFAULT_T
         )
         return
 
-    document = update.message.document
-    filename = document.file_name or "upload.xlsx"
-    ext = Path(filename).suffix.lower()
-    if ext not in {".xlsx", ".xls", ".xlsm"}:
-        await update.message.reply_text("Нужен Excel-файл с расширением `.xlsx`, `.xls` или `.xlsm`.")
-        return
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = format_now("%Y%m%d_%H%M%S")
     PARSER_TMP_DIR.mkdir(parents=True, exist_ok=True)
     PARSER_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -1262,52 +1949,14 @@ async def parse_document_handler(update: Update, context: ContextTypes.DEFAULT_T
 
     try:
         tg_file = await context.bot.get_file(document.file_id)
-        await tg_file.download_to_drive(custom_path=str(input_path))
-
-        excel_file = pd.ExcelFile(input_path)
-        sheets = excel_file.sheet_names
-        if "зимние скидки" in sheets:
-            sheet_name = "зимние скидки"
-            header = 0
-        else:
-            sheet_name = sheets[0] if sheets else "Sheet1"
-            header = 2
+        await tg_file.download_to_drive(custom_path=str(input_path), read_timeout=PARSER_FILE_TIMEOUT)
 
-        df_headers = pd.read_excel(
-            input_path,
-            sheet_name=sheet_name,
-            header=header,
-            nrows=0
+        # pandas и генерация сайта блокируют на секунды — уводим их с event loop.
+        # Фид меняем уже в основном потоке: его кэш разделяют остальные обработчики.
+        df, cards, excel_items, mapping_source, preview_text = await asyncio.to_thread(
+            _run_parser_sync, input_path, output_dir
         )
-        excel_columns = list(df_headers.columns)
-
-        mapping = config_manager.get_mapping_template(input_path.stem)
-        mapping_source = "template"
-
-        if not mapping:
-            mapping_source = "auto"
-            config = config_manager.load_config()
-            target_fields = list(config.get("fuzzy_keywords", {}).keys())
-            auto_result = column_mapper.auto_map_columns(
-                excel_columns,
-                target_fields,
-                config.get("fuzzy_keywords", {})
-            )
-            mapping = auto_result.get("mapping", {})
-            is_valid, missing_critical = column_mapper.validate_mapping(mapping)
-            if not is_valid:
-                missing_str = ", ".join(missing_critical)
-                raise ValueError(f"Не удалось сопоставить обязательные столбцы: {missing_str}")
-
-        df = read_flexible(
-            input_path,
-            mapping=mapping,
-            sheet_name=sheet_name,
-            header=header
-        )
-        cards = prepare_cards(df)
-        generate_site(cards, output_dir)
-        excel_ads_count = replace_excel_ads(cards)
+        excel_ads_count = replace_excel_feed_items(excel_items)
 
         index_path = output_dir / "index.html"
 
@@ -1321,10 +1970,6 @@ async def parse_document_handler(update: Update, context: ContextTypes.DEFAULT_T
         )
         await update.message.reply_text(summary)
 
-        preview_df = df.head(8).fillna("")
-        preview_text = preview_df.to_string(index=False)
-        if len(preview_text) > 3500:
-            preview_text = preview_text[:3500] + "\n..."
         await update.message.reply_text(
             "📊 Предпросмотр таблицы (первые строки):\n"
             f"<pre>{html.escape(preview_text)}</pre>",
@@ -1332,11 +1977,13 @@ async def parse_document_handler(update: Update, context: ContextTypes.DEFAULT_T
         )
 
         if index_path.exists():
-            with open(index_path, "rb") as f:
-                await update.message.reply_document(
-                    document=f,
-                    filename=f"index_{timestamp}.html"
-                )
+            # PTB всё равно загружает документ в память целиком — читаем его в потоке, не блокируя loop.
+            index_bytes = await asyncio.to_thread(index_path.read_bytes)
+            await update.message.reply_document(
+                document=index_bytes,
+                filename=f"index_{timestamp}.html",
+                write_timeout=PARSER_FILE_TIMEOUT
+            )
 
         log_user_action(user_data, "parse_success", f"Файл обработан: {filename}, карточек: {len(cards)}")
     except Exception as e:
@@ -1357,12 +2004,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
     
     user = query.from_user
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not is_user_authenticated(user.id):
         await prompt_authentication(update, context, reason=f"Нажатие кнопки: {query.data}")
@@ -1373,193 +2015,56 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     if query.data == 'profile':
         await send_profile_card(update, context)
-    
-    elif query.data == 'rating':
-        rating_text = """
-<b>⭐ Рейтинг РА Эксперт 2022</b>
-
-Мы гордимся, что <b>КФЛ Лизинг занимает 30 место</b> в рейтинге РА Эксперт по объему нового бизнеса в лизинге за 9 месяцев 2022 года.
-
-<b>🏆 Наши достижения:</b>
-• 📈 Более 10 лет стабильной работы на рынке
-• ✅ 60+ актуальных предложений в каталоге
-• 🏗️ 4 основные категории техники
-• 💼 Индивидуальные условия лизинга для каждого клиента
-
-<b>🔗 Ссылка на рейтинг:</b>
-https://raexpert.ru/rankingtable/leasing/9m2022/main/
-"""
-        
-        keyboard = [
-            [InlineKeyboardButton("🌐 Открыть рейтинг", url="https://raexpert.ru/rankingtable/leasing/9m2022/main/")],
-            [build_web_app_button(user.id)],
-            [InlineKeyboardButton("◀️ Назад", callback_data='menu')]
-        ]
-        
-        await query.edit_message_text(
-            rating_text,
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif query.data == 'contacts':
-        contacts_text = """
-<b>📞 Контакты КФЛ Лизинг</b>
-
-<b>📍 Адрес:</b>
-г. Новокузнецк
-
-<b>☎️ Телефон:</b>
-+7 (XXX) XXX-XX-XX
-
-<b>📧 Email:</b>
-info@kuzfl.ru
-
-<b>🕒 Часы работы:</b>
-Пн-Пт: 9:00 - 18:00
-Сб: 10:00 - 16:00  
-Вс: выходной
-
-<b>👨‍💼 Для связи с менеджером:</b>
-Просто отправьте сообщение в этот чат, и мы перезвоним вам в рабочее время.
-"""
-        
-        keyboard = [
-            [build_web_app_button(user.id)],
-            [InlineKeyboardButton("📝 Оставить заявку", callback_data='request')],
-            [InlineKeyboardButton("◀️ Назад", callback_data='menu')]
-        ]
-        
-        await query.edit_message_text(
-            contacts_text,
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif query.data == 'about':
-        about_text = """
-<b>🏢 О компании КФЛ Лизинг</b>
-
-<b>🎯 Наша миссия:</b>
-Предоставлять клиентам доступ к качественной технике и оборудованию через удобные и прозрачные условия лизинга конфиската.
-
-<b>📊 Что мы предлагаем:</b>
-• Лизинг конфиската — техники и оборудования, изъятого у должников
-• Юридическую проверку всех лотов
-• Полное сопровождение сделки
-• Индивидуальный подход к каждому клиенту
-• Конкурентные ставки по лизингу
+        return
 
-<b>✅ Наши гарантии:</b>
-• Все предложения проверены юридически
-• Подробные технические характеристики
-• Честные цены без скрытых комиссий
-• Профессиональная консультация
-"""
-        
-        keyboard = [
-            [build_web_app_button(user.id)],
-            [InlineKeyboardButton("⭐ Наш рейтинг", callback_data='rating')],
-            [InlineKeyboardButton("◀️ Назад", callback_data='menu')]
-        ]
-        
+    screen = CALLBACK_SCREENS.get(query.data)
+    if screen is not None:
+        text, build_markup = screen
         await query.edit_message_text(
-            about_text,
+            text,
             parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=build_markup(user.id)
         )
-    
-    elif query.data == 'manager':
-        manager_text = """
-<b>👨‍💼 Связь с менеджером</b>
 
-Для связи с персональным менеджером и консультации по вопросам лизинга:
-
-<b>☎️ Позвоните:</b>
-+7 (XXX) XXX-XX-XX
-
-<b>📧 Напишите:</b>
-info@kuzfl.ru
-
-<b>💬 Или оставьте заявку здесь:</b>
-Просто отправьте сообщение с вашими контактными данными, и наш менеджер свяжется с вами в течение 30 минут в рабочее время.
-
-<b>🕒 Работаем:</b>
-Понедельник - Пятница: 9:00 - 18:00
-"""
-        
-        keyboard = [
-            [build_web_app_button(user.id)],
-            [InlineKeyboardButton("◀️ Назад в меню", callback_data='menu')]
-        ]
-        
-        await query.edit_message_text(
-            manager_text,
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif query.data == 'request':
-        request_text = """
-<b>📝 Заявка на консультацию</b>
+ADMIN_BROADCAST_CONCURRENCY = 5
+_admin_broadcast_semaphore = asyncio.Semaphore(ADMIN_BROADCAST_CONCURRENCY)
 
-Для оформления заявки на лизинг или получения консультации:
 
-<b>1️⃣ Позвоните нам:</b>
-+7 (XXX) XXX-XX-XX
+async def _send_admin_notification(bot, admin_id: int, text: str, parse_mode: str) -> None:
+    async with _admin_broadcast_semaphore:
+        await bot.send_message(chat_id=admin_id, text=text, parse_mode=parse_mode)
 
-<b>2️⃣ Напишите на email:</b>
-info@kuzfl.ru
 
-<b>3️⃣ Или оставьте заявку здесь:</b>
-Отправьте сообщение с указанием:
-• Вашего имени
-• Контактного телефона  
-• Интересуемой техники (если есть)
+async def broadcast_to_admins(bot, text: str, *, parse_mode: str = 'HTML') -> None:
+    """Рассылает уведомление всем админам параллельно; ошибка одного не мешает остальным."""
+    admin_ids = tuple(ADMIN_IDS)
+    results = await asyncio.gather(
+        *(_send_admin_notification(bot, admin_id, text, parse_mode) for admin_id in admin_ids),
+        return_exceptions=True,
+    )
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка отправки уведомления админу {admin_id}: {result}")
 
-<b>⏱️ Мы перезвоним вам в течение 30 минут!</b>
-"""
-        
-        keyboard = [
-            [build_web_app_button(user.id)],
-            [InlineKeyboardButton("📞 Контакты", callback_data='contacts')],
-            [InlineKeyboardButton("◀️ Назад", callback_data='menu')]
-        ]
-        
-        await query.edit_message_text(
-            request_text,
-            parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    elif query.data == 'menu':
-        await query.edit_message_text(
-            "Главное меню:",
-            parse_mode='HTML',
-            reply_markup=build_main_menu_markup(user.id)
-        )
 
+# typed=True: иначе 1 и 1.0 делят запись кэша, а форматируются по-разному.
+@lru_cache(maxsize=8192, typed=True)
 def format_price(price: int) -> str:
     """Форматирование цены"""
-    return f"{price:,}".replace(',', ' ') + " ₽"
+    return f"{price:_}".replace('_', ' ') + " ₽"
 
 async def handle_leasing_request(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict) -> None:
     """Обработка заявки на лизинг товара"""
     user = update.effective_user
     product = data.get('product', {})
 
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     # Логируем заявку
     log_user_action(user_data, "leasing_request", f"Заявка на товар: {product.get('title', 'N/A')}")
 
     # Формируем сообщение для пользователя
-    safe_first_name = escape_html_for_telegram(user.first_name) if user.first_name else "Пользователь"
+    safe_first_name = escape_user_name(user.first_name, "Пользователь")
     user_message = f"""
 ✅ <b>Заявка принята!</b>
 
@@ -1581,52 +2086,39 @@ Email: info@kfl-leasing.ru
         reply_markup=build_main_menu_markup(user.id)
     )
 
-    # Отправляем уведомление администраторам
+    # Отправляем уведомление администраторам простым текстом: без HTML поля пользователя не нужно экранировать
     admin_message = f"""
-🔔 <b>НОВАЯ ЗАЯВКА НА ЛИЗИНГ</b>
+🔔 НОВАЯ ЗАЯВКА НА ЛИЗИНГ
 
-<b>👤 Клиент:</b>
-• Имя: {escape_html_for_telegram(user.first_name or '')} {escape_html_for_telegram(user.last_name or '')}
+👤 Клиент:
+• Имя: {user.first_name or ''} {user.last_name or ''}
 • Username: @{user.username or 'не указан'}
-• ID: <code>{user.id}</code>
+• ID: {user.id}
 
-<b>📦 Товар:</b>
-• Название: {escape_html_for_telegram(product.get('title', 'N/A'))}
+📦 Товар:
+• Название: {product.get('title', 'N/A')}
 • ID товара: {product.get('id', 'N/A')}
-• Категория: {escape_html_for_telegram(product.get('category', 'N/A'))}
+• Категория: {product.get('category', 'N/A')}
 • Цена: {format_price(product.get('price', 0))}
 • Год: {product.get('year', 'N/A')}
-• Регион: {escape_html_for_telegram(product.get('region', 'N/A'))}
+• Регион: {product.get('region', 'N/A')}
 
-<b>⏰ Время:</b> {data.get('timestamp', 'N/A')}
+⏰ Время: {data.get('timestamp', 'N/A')}
 """
 
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=admin_message,
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+    await broadcast_to_admins(context.bot, admin_message, parse_mode=None)
 
 async def handle_calculator_request(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict) -> None:
     """Обработка заявки из калькулятора лизинга"""
     user = update.effective_user
 
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     # Логируем заявку
     log_user_action(user_data, "calculator_request", f"Заявка из калькулятора на сумму {data.get('price', 0)}")
 
     # Формируем сообщение для пользователя
-    safe_first_name = escape_html_for_telegram(user.first_name) if user.first_name else "Пользователь"
+    safe_first_name = escape_user_name(user.first_name, "Пользователь")
 
     price = data.get('price', 0)
     advance_percent = data.get('advance', 20)
@@ -1669,50 +2161,45 @@ Email: info@kfl-leasing.ru
 
     # Отправляем уведомление администраторам
     admin_message = f"""
-🧮 <b>НОВАЯ ЗАЯВКА ИЗ КАЛЬКУЛЯТОРА</b>
+🧮 НОВАЯ ЗАЯВКА ИЗ КАЛЬКУЛЯТОРА
 
-<b>👤 Клиент:</b>
-• Имя: {escape_html_for_telegram(user.first_name or '')} {escape_html_for_telegram(user.last_name or '')}
+👤 Клиент:
+• Имя: {user.first_name or ''} {user.last_name or ''}
 • Username: @{user.username or 'не указан'}
-• ID: <code>{user.id}</code>
+• ID: {user.id}
 
-<b>🧮 Параметры расчета:</b>
+🧮 Параметры расчета:
 • Стоимость техники: {format_price(price)}
 • Первоначальный взнос: {advance_percent}% ({format_price(advance_amount)})
 • Срок лизинга: {term} месяцев
 • Процентная ставка: {rate}%
 
-<b>💳 Расчетные данные:</b>
+💳 Расчетные данные:
 • Ежемесячный платеж: {format_price(monthly_payment)}
 • Переплата: {format_price(overpayment)}
 • Общая сумма: {format_price(total_amount)}
 
-<b>⏰ Время:</b> {data.get('timestamp', 'N/A')}
+⏰ Время: {data.get('timestamp', 'N/A')}
 """
 
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=admin_message,
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+    await broadcast_to_admins(context.bot, admin_message, parse_mode=None)
+
+CATEGORY_EMOJI = {
+    'spec': '🚜',
+    'truck': '🚛',
+    'passenger': '🚗',
+    'equipment': '⚙️'
+}
+
 
 async def handle_new_advertisement(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict) -> None:
     """Обработка нового объявления от пользователя"""
     user = update.effective_user
     ad = data.get('ad', {})
 
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
-    if not can_user_manage_ads(user.id):
+    if not await can_user_manage_ads(user.id):
         await update.message.reply_text(
             "⛔ Публикация объявлений доступна только ролям «Администратор» и «Лизинговая компания»."
         )
@@ -1724,7 +2211,7 @@ async def handle_new_advertisement(update: Update, context: ContextTypes.DEFAULT
     saved_ad = add_manual_ad_to_feed(ad, user_data)
 
     # Формируем сообщение для пользователя
-    safe_first_name = escape_html_for_telegram(user.first_name) if user.first_name else "Пользователь"
+    safe_first_name = escape_user_name(user.first_name, "Пользователь")
     user_message = f"""
 ✅ <b>Объявление опубликовано!</b>
 
@@ -1748,46 +2235,34 @@ Email: info@kfl-leasing.ru
     )
 
     # Отправляем уведомление администраторам
-    category_emoji = {
-        'spec': '🚜',
-        'truck': '🚛',
-        'passenger': '🚗',
-        'equipment': '⚙️'
-    }
-    emoji = category_emoji.get(ad.get('category', ''), '📦')
+    emoji = CATEGORY_EMOJI.get(ad.get('category', ''), '📦')
+    images = ad.get('images')
+    images_count = len(images) if isinstance(images, list) else 0
 
     admin_message = f"""
-📝 <b>НОВОЕ ОБЪЯВЛЕНИЕ ОТ ПОЛЬЗОВАТЕЛЯ</b>
+📝 НОВОЕ ОБЪЯВЛЕНИЕ ОТ ПОЛЬЗОВАТЕЛЯ
 
-<b>👤 Автор:</b>
-• Имя: {escape_html_for_telegram(user.first_name or '')} {escape_html_for_telegram(user.last_name or '')}
+👤 Автор:
+• Имя: {user.first_name or ''} {user.last_name or ''}
 • Username: @{user.username or 'не указан'}
-• ID: <code>{user.id}</code>
-• Контакт: {escape_html_for_telegram(ad.get('contact', 'N/A'))}
+• ID: {user.id}
+• Контакт: {ad.get('contact', 'N/A')}
 
-<b>{emoji} Объявление:</b>
-• Название: {escape_html_for_telegram(ad.get('title', 'N/A'))}
-• Категория: {escape_html_for_telegram(ad.get('category', 'N/A'))}
+{emoji} Объявление:
+• Название: {ad.get('title', 'N/A')}
+• Категория: {ad.get('category', 'N/A')}
 • Цена: {format_price(ad.get('price', 0))}
 • Год: {ad.get('year', 'N/A')}
-• Регион: {escape_html_for_telegram(ad.get('location', 'N/A'))}
+• Регион: {ad.get('location', 'N/A')}
 
-<b>📄 Описание:</b>
-{escape_html_for_telegram(ad.get('details', 'N/A')[:500])}
+📄 Описание:
+{ad.get('details', 'N/A')[:500]}
 
-<b>📷 Фотографий:</b> {len(ad.get('images', [])) if isinstance(ad.get('images'), list) else 0}
-<b>⏰ Время:</b> {ad.get('createdAt', 'N/A')}
+📷 Фотографий: {images_count}
+⏰ Время: {ad.get('createdAt', 'N/A')}
 """
 
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=admin_message,
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+    await broadcast_to_admins(context.bot, admin_message, parse_mode=None)
 
 
 async def handle_update_advertisement(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict) -> None:
@@ -1799,18 +2274,13 @@ async def handle_update_advertisement(update: Update, context: ContextTypes.DEFA
     if not user:
         return
 
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not ad_id:
         await update.message.reply_text("⛔ Не передан ID объявления для обновления.")
         return
 
-    role = get_user_role(user.id)
+    role = await resolve_user_role(user.id)
     updated_ad, error_message = update_manual_ad_in_feed(ad_id, ad_updates, user_data, role)
     if not updated_ad:
         await update.message.reply_text(f"⛔ {error_message}")
@@ -1832,18 +2302,13 @@ async def handle_delete_advertisement(update: Update, context: ContextTypes.DEFA
     if not user:
         return
 
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not ad_id:
         await update.message.reply_text("⛔ Не передан ID объявления для удаления.")
         return
 
-    role = get_user_role(user.id)
+    role = await resolve_user_role(user.id)
     deleted, error_message = delete_manual_ad_from_feed(ad_id, user_data, role)
     if not deleted:
         await update.message.reply_text(f"⛔ {error_message}")
@@ -1857,6 +2322,22 @@ async def handle_delete_advertisement(update: Update, context: ContextTypes.DEFA
     )
 
 
+async def handle_parse_request(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict) -> None:
+    """Запуск импорта Excel из WebApp (кнопка «Парсер»)."""
+    await parse_command(update, context)
+
+
+# action из данных WebApp -> обработчик (update, context, data)
+WEB_APP_ACTIONS = {
+    'leasing_request': handle_leasing_request,
+    'calculator_request': handle_calculator_request,
+    'new_advertisement': handle_new_advertisement,
+    'update_advertisement': handle_update_advertisement,
+    'delete_advertisement': handle_delete_advertisement,
+    'parse_request': handle_parse_request,
+}
+
+
 async def web_app_data_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик данных из Web App"""
     try:
@@ -1865,24 +2346,15 @@ async def web_app_data_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
         # Получаем данные из Web App
         web_app_data = update.message.web_app_data.data
-        data = json.loads(web_app_data)
+        data = json_loads(web_app_data)
 
         logger.info(f"Получены данные из WebApp: {data}")
 
         action = data.get('action')
 
-        if action == 'leasing_request':
-            await handle_leasing_request(update, context, data)
-        elif action == 'calculator_request':
-            await handle_calculator_request(update, context, data)
-        elif action == 'new_advertisement':
-            await handle_new_advertisement(update, context, data)
-        elif action == 'update_advertisement':
-            await handle_update_advertisement(update, context, data)
-        elif action == 'delete_advertisement':
-            await handle_delete_advertisement(update, context, data)
-        elif action == 'parse_request':
-            await parse_command(update, context)
+        handler = WEB_APP_ACTIONS.get(action)
+        if handler is not None:
+            await handler(update, context, data)
         else:
             logger.warning(f"Неизвестное действие из WebApp: {action}")
             await update.message.reply_text(
@@ -1906,12 +2378,7 @@ async def web_app_data_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик неизвестных команд (доступен всем)"""
     user = update.effective_user
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     # Логируем неизвестную команду
     log_user_action(user_data, "unknown_command", f"Неизвестная команда: {update.message.text}")
@@ -1929,12 +2396,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     message_text = update.message.text
     
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    user_data = user_ctx(user)
 
     if not await ensure_authenticated(update, context, reason="Обычное сообщение"):
         return
@@ -1942,7 +2404,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_user_action(user_data, "message", f"Сообщение пользователя: {message_text[:50]}...")
     
     # Экранируем имя пользователя для безопасного использования в HTML
-    safe_first_name = escape_html_for_telegram(user.first_name) if user.first_name else "Пользователь"
+    safe_first_name = escape_user_name(user.first_name, "Пользователь")
     safe_message_text = escape_html_for_telegram(message_text[:100]) if message_text else ""
     
     response_text = f"""
@@ -1967,8 +2429,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def main() -> None:
     """Основная функция запуска бота"""
+    if uvloop is not None:
+        # Политику ставим до run_polling: PTB создаёт цикл событий уже через неё
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     # Создаем приложение
-    application = Application.builder().token(TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(start_background_tasks)
+        .post_stop(stop_background_tasks)
+        .build()
+    )
 
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start))
@@ -1995,25 +2467,27 @@ def main() -> None:
     logger.info("Build version: %s", BOT_BUILD_VERSION)
     logger.info("WebApp URL base: %s", HTML_FILE_URL)
     if ADMIN_IDS:
-        logger.info("WebApp URL (admin): %s", build_web_app_url(ADMIN_IDS[0]))
-    logger.info(f"Логи пользователей сохраняются в: {USERS_LOG_FILE}")
-    logger.info(f"Файл аутентификации: {AUTH_USERS_FILE}")
-    logger.info(f"Администратор: ID {ADMIN_IDS[0]}")
+        logger.info("WebApp URL (admin): %s", build_web_app_url(min(ADMIN_IDS)))
+    logger.info("Логи пользователей сохраняются в: %s", USERS_LOG_FILE)
+    logger.info("Файл аутентификации: %s", AUTH_USERS_FILE)
+    logger.info("Администраторы: ID %s", ", ".join(map(str, sorted(ADMIN_IDS))))
     logger.info("Доступ к командам открыт только после аутентификации через контакт")
     logger.info("Команда /stats доступна только администратору")
     if backend_sync_enabled():
         logger.info("Backend sync: ENABLED (%s)", DJANGO_BACKEND_URL)
     else:
         logger.info("Backend sync: disabled (set DJANGO_BACKEND_URL + DJANGO_BACKEND_API_KEY)")
+    logger.info("Event loop: %s", "uvloop" if uvloop is not None else "asyncio")
     if is_parser_enabled():
         logger.info("Excel parser: ENABLED")
     else:
         logger.warning("Excel parser: disabled (%s)", PARSER_IMPORT_ERROR or "module not found")
     
     # Выводим информацию о существующей статистике
+    migrate_legacy_users_log()
     stats = get_user_stats()
     if "error" not in stats:
-        logger.info(f"Загружена существующая статистика: {stats.get('unique_users', 0)} уникальных пользователей")
+        logger.info("Загружена существующая статистика: %s уникальных пользователей", stats.get('unique_users', 0))
     
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
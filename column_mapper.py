@@ -3,6 +3,7 @@
 Система автоматического определения столбцов с использованием fuzzy matching.
 """
 
+import sys
 from difflib import SequenceMatcher
 from typing import List, Dict
 
@@ -36,54 +37,97 @@ def normalize_column_name(name: str) -> str:
     return name.lower().strip()
 
 
-def calculate_match_score(excel_col: str, keywords_dict: dict) -> int:
+def prepare_keywords(keywords_dict: dict) -> tuple:
     """
-    Вычисляет score совпадения столбца с ключевыми словами.
+    Нормализует ключевые слова поля один раз, а не для каждого столбца Excel.
 
     Args:
-        excel_col: Название столбца из Excel (уже нормализованное)
         keywords_dict: Словарь с ключами 'primary' и 'synonyms'
 
     Returns:
-        int: Score от 0 до 100
+        tuple: (primary, synonyms) — кортежи нормализованных ключевых слов
     """
-    primary = keywords_dict.get("primary", [])
-    synonyms = keywords_dict.get("synonyms", [])
+    # intern: точное совпадение со столбцом (тоже интернированным) сравнивается по указателю
+    primary = tuple(sys.intern(normalize_column_name(k)) for k in keywords_dict.get("primary", []))
+    synonyms = tuple(sys.intern(normalize_column_name(k)) for k in keywords_dict.get("synonyms", []))
+    return primary, synonyms
+
+
+# Последний скомпилированный словарь: (исходный keywords, target_fields, результат).
+# Ссылка на исходный словарь держит его живым, поэтому проверка `is` надёжна.
+_compiled_keywords_cache = [None, None, None]
+
+
+def compile_keywords(target_fields: List[str], keywords: dict) -> tuple:
+    """
+    Готовит плоский список ((field, primary, synonyms), ...) для auto_map_columns.
+
+    load_config возвращает один и тот же словарь, пока config.json не меняется,
+    поэтому при повторных импортах нормализация ключевых слов не повторяется.
+    Изменённый на месте (без save_config) словарь нужно передавать копией.
+
+    Args:
+        target_fields: Список целевых полей в порядке сопоставления
+        keywords: Словарь ключевых слов из config.json
+
+    Returns:
+        tuple: Поля с непустыми ключевыми словами и их нормализованные кортежи
+    """
+    fields_key = tuple(target_fields)
+    cached_source, cached_fields, compiled = _compiled_keywords_cache
+    if cached_source is keywords and cached_fields == fields_key:
+        return compiled
+
+    compiled = tuple(
+        (field, *prepare_keywords(keywords[field]))
+        for field in fields_key
+        if keywords.get(field)
+    )
+    _compiled_keywords_cache[:] = [keywords, fields_key, compiled]
+    return compiled
 
-    best_score = 0
 
+def calculate_match_score(excel_col: str, primary: tuple, synonyms: tuple) -> int:
+    """
+    Вычисляет score совпадения столбца с ключевыми словами.
+
+    Args:
+        excel_col: Название столбца из Excel (уже нормализованное)
+        primary: Нормализованные основные ключевые слова (см. prepare_keywords)
+        synonyms: Нормализованные синонимы
+
+    Returns:
+        int: Score от 0 до 100
+    """
     # 1. Exact match в primary - 100%
-    for keyword in primary:
-        norm_keyword = normalize_column_name(keyword)
-        if excel_col == norm_keyword:
-            return 100
+    if excel_col in primary:
+        return 100
 
     # 2. Partial match в primary - 90%
     for keyword in primary:
-        norm_keyword = normalize_column_name(keyword)
-        if norm_keyword in excel_col or excel_col in norm_keyword:
-            best_score = max(best_score, 90)
+        if keyword in excel_col or excel_col in keyword:
+            return 90
 
     # 3. Exact match в synonyms - 70%
-    for keyword in synonyms:
-        norm_keyword = normalize_column_name(keyword)
-        if excel_col == norm_keyword:
-            best_score = max(best_score, 70)
+    if excel_col in synonyms:
+        return 70
 
     # 4. Partial match в synonyms - 60%
     for keyword in synonyms:
-        norm_keyword = normalize_column_name(keyword)
-        if norm_keyword in excel_col or excel_col in norm_keyword:
-            best_score = max(best_score, 60)
+        if keyword in excel_col or excel_col in keyword:
+            return 60
 
     # 5. Levenshtein similarity для опечаток - 40-50%
-    if best_score == 0:
-        for keyword in primary + synonyms:
-            norm_keyword = normalize_column_name(keyword)
-            similarity = levenshtein_similarity(excel_col, norm_keyword)
-            if similarity > 0.7:
-                score = int(similarity * 50)
-                best_score = max(best_score, score)
+    best_score = 0
+    matcher = SequenceMatcher(None, excel_col, "")
+    for keyword in primary + synonyms:
+        # ratio() не больше дешёвых quick-оценок: если они не проходят порог, полный расчёт не нужен
+        matcher.set_seq2(keyword)
+        if matcher.real_quick_ratio() <= 0.7 or matcher.quick_ratio() <= 0.7:
+            continue
+        similarity = matcher.ratio()
+        if similarity > 0.7:
+            best_score = max(best_score, int(similarity * 50))
 
     return best_score
 
@@ -110,7 +154,7 @@ def auto_map_columns(
         }
     """
     # Нормализуем названия столбцов
-    normalized = {col: normalize_column_name(col) for col in excel_columns}
+    normalized = {col: sys.intern(normalize_column_name(col)) for col in excel_columns}
 
     # Маппинг: excel_column -> target_field
     mapping = {}
@@ -120,11 +164,7 @@ def auto_map_columns(
     used_excel_cols = set()
 
     # Для каждого target field ищем лучший match
-    for field in target_fields:
-        field_keywords = keywords.get(field, {})
-        if not field_keywords:
-            continue
-
+    for field, primary, synonyms in compile_keywords(target_fields, keywords):
         best_match = None
         best_score = 0
 
@@ -133,11 +173,14 @@ def auto_map_columns(
                 continue
 
             norm_col = normalized[excel_col]
-            score = calculate_match_score(norm_col, field_keywords)
+            score = calculate_match_score(norm_col, primary, synonyms)
 
             if score > best_score:
                 best_score = score
                 best_match = excel_col
+                # 100 — максимум: следующие столбцы уже не смогут его превзойти
+                if score == 100:
+                    break
 
         # Применяем только если score >= 40 (threshold)
         if best_match and best_score >= 40:
@@ -192,11 +235,9 @@ def detect_duplicate_mappings(mapping: dict) -> List[str]:
     Returns:
         List[str]: Список дублирующихся target полей
     """
-    from collections import Counter
-
-    target_values = list(mapping.values())
-    counts = Counter(target_values)
-
-    duplicates = [field for field, count in counts.items() if count > 1]
+    # field -> встречался ли повторно; dict сохраняет порядок первого появления, как Counter
+    repeated = {}
+    for field in mapping.values():
+        repeated[field] = field in repeated
 
-    return duplicates
+    return [field for field, is_duplicate in repeated.items() if is_duplicate]
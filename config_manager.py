@@ -7,27 +7,59 @@ import json
 from pathlib import Path
 from typing import Optional
 
+try:
+    import orjson
+except ImportError:  # orjson не установлен — используем стандартный json
+    orjson = None
+
 
 CONFIG_PATH = Path(__file__).parent / "config.json"
 
+def _dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Разобранный config.json и отметка файла (mtime_ns, size), с которой он прочитан.
+_config_cache = {"stamp": None, "data": None}
+
 
 def load_config() -> dict:
     """
     Загружает конфигурацию из config.json или возвращает default.
 
+    Пока файл не меняется, возвращается один и тот же закэшированный словарь;
+    изменять его можно только с последующим save_config.
+
     Returns:
         dict: Конфигурация с ключами 'fuzzy_keywords' и 'mappings'
     """
-    if not CONFIG_PATH.exists():
+    try:
+        stat = CONFIG_PATH.stat()
+    except OSError:
         return get_default_config()
 
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if _config_cache["stamp"] == stamp:
+        return _config_cache["data"]
+
     try:
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        data = _loads(CONFIG_PATH.read_bytes())
     except Exception as e:
         print(f"Ошибка чтения config.json: {e}")
         return get_default_config()
 
+    _config_cache["stamp"] = stamp
+    _config_cache["data"] = data
+    return data
+
 
 def save_config(config: dict) -> bool:
     """
@@ -39,9 +71,10 @@ def save_config(config: dict) -> bool:
     Returns:
         bool: True если успешно, False при ошибке
     """
+    # Сбрасываем кэш в любом случае: при ошибке записи словарь мог уже быть изменён вызывающим
+    _config_cache["stamp"] = None
     try:
-        with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        CONFIG_PATH.write_bytes(_dumps(config))
         return True
     except Exception as e:
         print(f"Ошибка сохранения config.json: {e}")
@@ -36,8 +36,8 @@ FILE2 = BASE_DIR / "Копия СТОК Зимняя выгода.xlsx"
 
 # ─── Чтение и нормализация данных ────────────────────────────────────────────
 
-def read_file1(path: Path) -> pd.DataFrame:
-    """Читает основной файл стока."""
+def read_file1(path: Path | pd.ExcelFile) -> pd.DataFrame:
+    """Читает основной файл стока (путь или уже открытый pd.ExcelFile)."""
     df = pd.read_excel(path, sheet_name="Sheet1", header=2)
     df = df.rename(columns={
         "Код предложения": "code",
@@ -70,8 +70,8 @@ def read_file1(path: Path) -> pd.DataFrame:
     return df
 
 
-def read_file2(path: Path) -> pd.DataFrame:
-    """Читает файл зимних скидок."""
+def read_file2(path: Path | pd.ExcelFile) -> pd.DataFrame:
+    """Читает файл зимних скидок (путь или уже открытый pd.ExcelFile)."""
     df = pd.read_excel(path, sheet_name="зимние скидки")
     df = df.rename(columns={
         "Код предложения": "code",
@@ -143,7 +143,7 @@ def safe_convert_price(value):
 
 
 def read_flexible(
-    path: Path,
+    path: Path | pd.ExcelFile,
     mapping: dict,
     sheet_name: str = None,
     header: int = None
@@ -152,7 +152,7 @@ def read_flexible(
     Универсальная функция чтения Excel с гибким маппингом.
 
     Args:
-        path: Путь к Excel файлу
+        path: Путь к Excel файлу или уже открытый pd.ExcelFile
         mapping: Словарь маппинга {excel_column: target_field}
         sheet_name: Название листа (auto-detect если None)
         header: Строка с заголовками (auto-detect если None)
@@ -160,9 +160,12 @@ def read_flexible(
     Returns:
         pd.DataFrame с нормализованными столбцами
     """
+    # Книгу открываем один раз: разбор zip/xml у xlsx дорогой
+    excel_file = path if isinstance(path, pd.ExcelFile) else pd.ExcelFile(path)
+
     # Автоопределение sheet и header если не указаны
     if sheet_name is None or header is None:
-        sheets = pd.ExcelFile(path).sheet_names
+        sheets = excel_file.sheet_names
         if "зимние скидки" in sheets:
             sheet_name = "зимние скидки"
             header = 0
@@ -171,7 +174,7 @@ def read_flexible(
             header = 2  # Для стандартных файлов стока
 
     # Читаем Excel
-    df = pd.read_excel(path, sheet_name=sheet_name, header=header)
+    df = excel_file.parse(sheet_name=sheet_name, header=header)
 
     # Обрабатываем дублирующиеся столбцы
     df = handle_duplicate_columns(df)
@@ -791,7 +794,8 @@ function renderPage() {
 }
 
 /* ── Отрисовка карточек ── */
-function esc(s) { return s ? s.replace(/&/g,'&amp;').replace(/</g,'&lt;').replace(/>/g,'&gt;').replace(/"/g,'&quot;') : ''; }
+const ESC_MAP = {'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;'};
+function esc(s) { return s ? s.replace(/[&<>"]/g, c => ESC_MAP[c]) : ''; }
 
 const COLOR_MAP = {
   'белый':'#f5f5f5','белай':'#f5f5f5','серый':'#9e9e9e','светло-серый':'#bdbdbd','темно-серый':'#616161',
@@ -1301,10 +1305,11 @@ def generate_site(cards: list[dict], output_dir: Path):
 
 def detect_and_read(path: Path) -> pd.DataFrame:
     """Определяет формат файла и читает его подходящим ридером."""
-    sheets = pd.ExcelFile(path).sheet_names
-    if "зимние скидки" in sheets:
-        return read_file2(path)
-    return read_file1(path)
+    # Та же книга идёт в ридер: второй раз xlsx не распаковывается и не разбирается
+    with pd.ExcelFile(path) as excel_file:
+        if "зимние скидки" in excel_file.sheet_names:
+            return read_file2(excel_file)
+        return read_file1(excel_file)
 
 
 class ParserGUI:
@@ -1469,8 +1474,7 @@ class ParserGUI:
                 header = 2
 
             # Читаем только заголовки (nrows=0 для скорости)
-            df_headers = pd.read_excel(
-                filepath,
+            df_headers = excel_file.parse(
                 sheet_name=sheet_name,
                 header=header,
                 nrows=0